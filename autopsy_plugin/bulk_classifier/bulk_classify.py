@@ -0,0 +1,285 @@
+# --- Headless Bulk Classifier: classifies one or many mmssms.db files outside Autopsy, against the same Flask server ---
+# CPython only. Rows are streamed in date order, duplicates are collapsed with the plugin's sms_dedupe.py, and chunks of
+# representatives go to /reply_batch from parallel workers. Results land in a SQLite store keyed by
+# (sha256 of the mmssms.db file, "sms:<_id>" / "mms:<_id>"), so an interrupted run resumes where it stopped and the
+# Autopsy plugin can later import the precomputed results instead of calling the LLM.
+#
+# Usage: python bulk_classify.py extractions/ --out results.db --workers 8
+#        python bulk_classify.py data_samples/autopsy_plugin_mmssms.db --out results.db --parquet results.parquet
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugin"))
+from sms_dedupe import SmsClusterIndex, ClusterResults  # noqa: E402  (pure Python, shared with the Jython plugin)
+from message_queries import message_query  # noqa: E402  (same SMS/MMS query as the plugin)
+
+# --- Classification server settings, as in the plugin: base URL, SMS per /reply_batch call, 429 retries ---
+LLM_API_URL = os.getenv("LLM_API_URL", "http://localhost:8000")
+LLM_BATCH_SIZE = 16
+LLM_BUSY_RETRIES = 5
+LLM_TIMEOUT = (5.0, 600.0)
+
+# --- Parallel /reply_batch requests in flight per worker pool, and how many chunks may wait for a free worker ---
+LLM_WORKERS = 4
+LLM_QUEUE_CHUNKS = 8
+
+DEDUPE_ENABLED = True
+DEDUPE_NEAR_THRESHOLD = 0.8
+
+# --- Rows written per SQLite transaction ---
+COMMIT_EVERY = 500
+
+# --- MMS text parts are read too, joined per message as in the plugin ---
+INCLUDE_MMS_TEXT = True
+
+
+# --- File Fingerprints: sha256 keys the results; md5 is kept too since it is the hash Autopsy computes by default ---
+def file_hashes(path):
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+            md5.update(block)
+    return sha256.hexdigest(), md5.hexdigest()
+
+
+# --- Same row fingerprint as the plugin's ingest ledger ---
+def body_hash(body):
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def find_databases(paths, name="mmssms.db"):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for file_name in sorted(files):
+                    if file_name == name:
+                        yield os.path.join(root, file_name)
+        else:
+            yield path
+
+
+# --- Results Store: one row per classified message; failed rows are not stored, so the next run retries them ---
+class ResultStore:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " db_sha256 TEXT PRIMARY KEY, db_md5 TEXT, path TEXT, messages INTEGER, completed REAL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " db_sha256 TEXT, row_key TEXT, source TEXT, msg_id INTEGER, thread_id INTEGER, address TEXT,"
+            " date INTEGER, type INTEGER, body_hash TEXT, result TEXT, classified REAL,"
+            " PRIMARY KEY (db_sha256, row_key))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sources_db_md5 ON sources (db_md5)")
+        self.conn.commit()
+        self._pending = 0
+
+    def done_keys(self, db_sha256):
+        return {row[0] for row in self.conn.execute("SELECT row_key FROM results WHERE db_sha256 = ?", (db_sha256,))}
+
+    def start_source(self, db_sha256, db_md5, path):
+        self.conn.execute(
+            "INSERT INTO sources (db_sha256, db_md5, path) VALUES (?, ?, ?)"
+            " ON CONFLICT (db_sha256) DO UPDATE SET path = excluded.path",
+            (db_sha256, db_md5, path),
+        )
+        self.conn.commit()
+
+    def finish_source(self, db_sha256, messages, completed):
+        self.conn.execute("UPDATE sources SET messages = ?, completed = ? WHERE db_sha256 = ?",
+                          (messages, time.time() if completed else None, db_sha256))
+        self.conn.commit()
+
+    def put(self, db_sha256, row, result):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (db_sha256, row["key"], row["source"], row["id"], row["thread_id"], row["address"], row["date"],
+             row["type"], row["hash"], json.dumps(result), time.time()),
+        )
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+# --- Classification Client: one keep-alive session shared by the workers; 429s wait for Retry-After like the plugin ---
+class BatchClient:
+    def __init__(self, api_url, provider=None, pool_size=LLM_WORKERS):
+        self.api_url = api_url
+        self.provider = provider
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def classify(self, texts):
+        payload = {"messages": texts}
+        if self.provider:
+            payload["provider"] = self.provider
+        for attempt in range(LLM_BUSY_RETRIES + 1):
+            try:
+                response = self.session.post(self.api_url + "/reply_batch", json=payload, timeout=LLM_TIMEOUT)
+            except requests.RequestException as e:
+                print("Error calling classification server:", str(e), file=sys.stderr)
+                return [None] * len(texts)
+            if response.status_code == 429 and attempt < LLM_BUSY_RETRIES:
+                time.sleep(float(response.headers.get("Retry-After") or 1.0))
+                continue
+            if response.status_code != 200:
+                print("Error calling classification server:", response.status_code, file=sys.stderr)
+                return [None] * len(texts)
+            try:
+                body = response.json()
+            except ValueError as e:
+                print("Classification server reply is not JSON:", str(e), file=sys.stderr)
+                return [None] * len(texts)
+            replies = (body.get("replies") if isinstance(body, dict) else None) or []
+            if len(replies) != len(texts):
+                print("Batch reply size mismatch: sent %d, received %d" % (len(texts), len(replies)), file=sys.stderr)
+                return [None] * len(texts)
+            return replies
+        return [None] * len(texts)
+
+
+def read_rows(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for row in conn.execute(message_query(tables, INCLUDE_MMS_TEXT)):
+            yield {
+                "key": "%s:%d" % (row["source"], row["_id"]),
+                "source": row["source"],
+                "id": row["_id"],
+                "thread_id": row["thread_id"],
+                "address": row["address"],
+                "date": row["date"],
+                "type": row["type"],
+                "body": row["body"],
+                "hash": body_hash(row["body"]),
+            }
+    finally:
+        conn.close()
+
+
+# --- One Database: reader and writer on this thread, /reply_batch chunks on the worker pool; at most
+#     workers + LLM_QUEUE_CHUNKS chunks are outstanding, so memory stays flat on large extractions ---
+def classify_database(path, store, client, executor, workers):
+    db_sha256, db_md5 = file_hashes(path)
+    store.start_source(db_sha256, db_md5, path)
+    done = store.done_keys(db_sha256)
+    index = SmsClusterIndex(DEDUPE_NEAR_THRESHOLD) if DEDUPE_ENABLED else None
+    clusters = ClusterResults() if DEDUPE_ENABLED else None
+    counts = {"messages": 0, "resumed": 0, "stored": 0, "failed": 0}
+    in_flight = deque()
+    pending = []
+
+    def write(items):
+        for row, result in items:
+            if isinstance(result, dict):
+                store.put(db_sha256, row, result)
+                counts["stored"] += 1
+            else:
+                counts["failed"] += 1
+
+    def collect_oldest():
+        chunk, future = in_flight.popleft()
+        for (cluster_id, row), result in zip(chunk, future.result()):
+            write(clusters.resolve(cluster_id, result) if cluster_id is not None else [(row, result)])
+
+    def send(chunk):
+        in_flight.append((chunk, executor.submit(client.classify, [row["body"] for _, row in chunk])))
+        while len(in_flight) > workers + LLM_QUEUE_CHUNKS or (in_flight and in_flight[0][1].done()):
+            collect_oldest()
+
+    for row in read_rows(path):
+        counts["messages"] += 1
+        if row["key"] in done:
+            counts["resumed"] += 1
+            continue
+        cluster_id = None
+        if index is not None:
+            cluster_id, is_new = index.assign(row["body"])
+            if not is_new:
+                write(clusters.add_member(cluster_id, row))
+                continue
+            clusters.add_representative(cluster_id, row)
+        pending.append((cluster_id, row))
+        if len(pending) >= LLM_BATCH_SIZE:
+            send(pending)
+            pending = []
+    if pending:
+        send(pending)
+    while in_flight:
+        collect_oldest()
+
+    store.finish_source(db_sha256, counts["messages"], counts["failed"] == 0)
+    store.commit()
+    if index is not None:
+        counts["clusters"] = len(index)
+    return dict(counts, path=path, db_sha256=db_sha256)
+
+
+# --- Optional Parquet export of the whole store (needs pyarrow) ---
+def export_parquet(store_path, parquet_path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet export needs pyarrow (pip install pyarrow)")
+    conn = sqlite3.connect(store_path)
+    cursor = conn.execute("SELECT * FROM results ORDER BY db_sha256, date")
+    columns = [d[0] for d in cursor.description]
+    rows = cursor.fetchall()
+    conn.close()
+    pq.write_table(pa.table({name: [row[i] for row in rows] for i, name in enumerate(columns)}), parquet_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify mmssms.db files outside Autopsy through the Flask server")
+    parser.add_argument("paths", nargs="+", help="mmssms.db files, or directories searched for mmssms.db")
+    parser.add_argument("--out", default="bulk_results.db", help="SQLite results store (resumed if it exists)")
+    parser.add_argument("--parquet", help="also export the store to this Parquet file")
+    parser.add_argument("--api-url", default=LLM_API_URL)
+    parser.add_argument("--provider", help="model provider requested from the server (ollama, openai, stub)")
+    parser.add_argument("--workers", type=int, default=LLM_WORKERS)
+    args = parser.parse_args()
+
+    store = ResultStore(args.out)
+    client = BatchClient(args.api_url.rstrip("/"), args.provider, args.workers)
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for path in find_databases(args.paths):
+                started = time.perf_counter()
+                summary = classify_database(path, store, client, executor, args.workers)
+                summary["seconds"] = round(time.perf_counter() - started, 2)
+                print(json.dumps(summary))
+    finally:
+        store.close()
+    if args.parquet:
+        export_parquet(args.out, args.parquet)
+
+
+if __name__ == '__main__':
+    main()
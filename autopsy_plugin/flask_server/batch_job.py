@@ -0,0 +1,232 @@
+# --- OpenAI Batch API Job: offline classification of whole case backlogs at batch pricing and batch rate limits ---
+# Four steps, each resumable from the job file:
+#   prepare  pending messages (not yet in the result cache) -> JSONL request files, one line per unique message
+#   submit   upload each file to /files (purpose "batch") and create a /batches job for it
+#   wait     poll /batches/{id} until every job is completed, failed, expired or cancelled
+#   merge    download the output files and store the validated replies in the result cache
+# After the merge, the plugin (or server.py) picks the results up as ordinary cache hits, so artifacts are created as usual.
+# Cache keys include the model, so the merged replies are only hits for requests the server sends to the "openai" provider:
+# run it with LLM_PROVIDER=openai for that ingest (or send "provider": "openai"); an Ollama-backed server ignores them.
+#
+# Usage: python batch_job.py run --input mmssms.db --job case42.job.json
+#        python batch_job.py prepare --input messages.txt --job case42.job.json   (then submit / wait / merge)
+# Local test: python stub_backend.py --port 11435 --batch-seconds 2
+#             OPENAI_API_URL=http://127.0.0.1:11435/v1/chat/completions python batch_job.py run --input mmssms.db --job t.json
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from classifier import (LLM_PROVIDER, OPENAI_API_KEY, OPENAI_API_URL, SYSTEM_MESSAGE, openai_client, providers, result_cache,
+                        output_quality)
+from output_schema import RESULT_SCHEMA, parse_result
+from request_log import log_event
+from result_cache import ResultCache, normalize_message
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugin"))
+from message_queries import message_query  # noqa: E402  (same SMS/MMS text per message as the plugin, so cache keys match)
+
+# --- Batch API Settings: base URL (derived from OPENAI_API_URL unless set), per-file request limit and poll interval ---
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", OPENAI_API_URL.rsplit("/chat/completions", 1)[0])
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_MAX_REQUESTS = 50000
+BATCH_POLL_SECONDS = 60.0
+BATCH_FINAL_STATES = ("completed", "failed", "expired", "cancelled")
+BATCH_PROVIDER = "openai"
+
+# --- Message Sources: SMS and MMS text from an mmssms.db (read exactly as the plugin reads it), a JSONL file
+#     ("body" or "message" per line) or plain text lines ---
+def read_messages(path):
+    if path.endswith(".db"):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            yield from (row[0] for row in conn.execute(f"SELECT body FROM ({message_query(tables)})"))
+        finally:
+            conn.close()
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                yield item.get("body") or item.get("message") or ""
+            else:
+                yield line.rstrip("\n")
+
+
+def api_headers():
+    return {"Authorization": f"Bearer {OPENAI_API_KEY}"}
+
+
+def api_json(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"Batch API error {response.status_code}: {response.text[:200]}")
+    return response.json()
+
+
+def load_job(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_job(path, job):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(job, f, indent=2)
+    os.replace(tmp, path)
+
+
+# --- Prepare: one request per unique message that has no cached reply; custom_id is the cache key, so merging needs no lookup table ---
+def prepare(input_path, job_path):
+    provider = providers[BATCH_PROVIDER]
+    if LLM_PROVIDER != BATCH_PROVIDER:
+        log_event("batch_provider_mismatch", logging.WARNING, server_provider=LLM_PROVIDER, batch_provider=BATCH_PROVIDER,
+                  detail=f"merged results are cached for {provider.model}; run the ingest with LLM_PROVIDER={BATCH_PROVIDER}")
+    seen = set()
+    files = []
+    out = None
+    total = cached = 0
+    for message in read_messages(input_path):
+        if not normalize_message(message):
+            continue
+        total += 1
+        key = ResultCache.make_key(message, provider.model, SYSTEM_MESSAGE)
+        if key in seen:
+            continue
+        seen.add(key)
+        if result_cache is not None and result_cache.contains(key):
+            cached += 1
+            continue
+        if out is None or files[-1]["requests"] >= BATCH_MAX_REQUESTS:
+            if out is not None:
+                out.close()
+            files.append({"input_path": f"{job_path}.part{len(files) + 1}.jsonl", "requests": 0})
+            out = open(files[-1]["input_path"], "w", encoding="utf-8")
+        out.write(json.dumps({
+            "custom_id": key,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": provider.request_body(message, SYSTEM_MESSAGE, RESULT_SCHEMA),
+        }, ensure_ascii=False) + "\n")
+        files[-1]["requests"] += 1
+    if out is not None:
+        out.close()
+
+    job = {"provider": BATCH_PROVIDER, "model": provider.model, "created": time.time(), "input": input_path, "messages": total,
+           "unique": len(seen), "cached": cached, "batches": files}
+    save_job(job_path, job)
+    log_event("batch_prepared", messages=total, unique=len(seen), cached=cached,
+              requests=sum(f["requests"] for f in files), files=len(files))
+    return job
+
+
+# --- Submit: upload each request file and create its batch; already-submitted files are skipped on a re-run ---
+def submit(job_path):
+    job = load_job(job_path)
+    for batch in job["batches"]:
+        if batch.get("batch_id"):
+            continue
+        with open(batch["input_path"], "rb") as f:
+            uploaded = api_json(openai_client.post(f"{OPENAI_BASE_URL}/files", headers=api_headers(),
+                                                   data={"purpose": "batch"},
+                                                   files={"file": (os.path.basename(batch["input_path"]), f)}))
+        batch["file_id"] = uploaded["id"]
+        created = api_json(openai_client.post(f"{OPENAI_BASE_URL}/batches", headers=api_headers(), json={
+            "input_file_id": uploaded["id"],
+            "endpoint": BATCH_ENDPOINT,
+            "completion_window": BATCH_COMPLETION_WINDOW,
+        }))
+        batch["batch_id"] = created["id"]
+        batch["status"] = created.get("status")
+        save_job(job_path, job)
+        log_event("batch_submitted", batch_id=created["id"], requests=batch["requests"])
+    return job
+
+
+# --- Wait: poll every unfinished batch until all of them reach a final state ---
+def wait(job_path, poll_seconds=BATCH_POLL_SECONDS):
+    job = load_job(job_path)
+    while True:
+        pending = [b for b in job["batches"] if b.get("batch_id") and b.get("status") not in BATCH_FINAL_STATES]
+        for batch in pending:
+            info = api_json(openai_client.get(f"{OPENAI_BASE_URL}/batches/{batch['batch_id']}", headers=api_headers()))
+            batch["status"] = info.get("status")
+            batch["output_file_id"] = info.get("output_file_id")
+            batch["error_file_id"] = info.get("error_file_id")
+            batch["request_counts"] = info.get("request_counts")
+        save_job(job_path, job)
+        if not any(b.get("status") not in BATCH_FINAL_STATES for b in pending):
+            break
+        log_event("batch_waiting", batches=len(pending),
+                  statuses=sorted({b["status"] for b in pending if b.get("status")}))
+        time.sleep(poll_seconds)
+    return job
+
+
+# --- Merge: validated replies go into the result cache under their custom_id; unusable or failed requests are left for
+#     the interactive path, which classifies them on first use ---
+def merge(job_path):
+    if result_cache is None:
+        raise RuntimeError("Merging needs the result cache (CACHE_ENABLED in classifier.py)")
+    job = load_job(job_path)
+    for batch in job["batches"]:
+        if batch.get("merged") or batch.get("status") != "completed" or not batch.get("output_file_id"):
+            continue
+        response = openai_client.get(f"{OPENAI_BASE_URL}/files/{batch['output_file_id']}/content", headers=api_headers())
+        if response.status_code != 200:
+            raise RuntimeError(f"Batch API error {response.status_code}: {response.text[:200]}")
+        stored = unusable = 0
+        for line in response.text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            reply = item.get("response") or {}
+            result, status = None, "invalid"
+            if reply.get("status_code") == 200:
+                result, status = parse_result(reply["body"]["choices"][0]["message"]["content"])
+            output_quality.record(status)
+            if result is None:
+                unusable += 1
+                continue
+            result_cache.put(item["custom_id"], job["model"], json.dumps(result))
+            stored += 1
+        batch.update(merged=True, stored=stored, unusable=unusable)
+        save_job(job_path, job)
+        log_event("batch_merged", logging.WARNING if unusable else logging.INFO,
+                  batch_id=batch["batch_id"], stored=stored, unusable=unusable)
+    return job
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline SMS classification through the OpenAI Batch API")
+    parser.add_argument("step", choices=["prepare", "submit", "wait", "merge", "run"])
+    parser.add_argument("--job", required=True, help="job state file; request files are written next to it")
+    parser.add_argument("--input", help="mmssms.db, .jsonl or text file of messages (prepare / run)")
+    parser.add_argument("--poll-seconds", type=float, default=BATCH_POLL_SECONDS)
+    args = parser.parse_args()
+
+    if args.step in ("prepare", "run"):
+        if not args.input:
+            parser.error("--input is required for prepare and run")
+        prepare(args.input, args.job)
+    if args.step in ("submit", "run"):
+        submit(args.job)
+    if args.step in ("wait", "run"):
+        wait(args.job, args.poll_seconds)
+    if args.step in ("merge", "run"):
+        merge(args.job)
+
+    job = load_job(args.job)
+    print(json.dumps({key: job[key] for key in ("messages", "unique", "cached")}
+                     | {"batches": [{k: b.get(k) for k in ("batch_id", "status", "requests", "stored", "unusable")}
+                                    for b in job["batches"]]}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
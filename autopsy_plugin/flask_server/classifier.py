@@ -0,0 +1,386 @@
+# --- Imports: model providers, json for payload handling, shared cache/metrics/HTTP pool helpers ---
+from concurrent.futures import ThreadPoolExecutor
+from result_cache import ResultCache
+from metrics import OutputQuality
+from request_log import log_event, text_field
+from providers import OllamaProvider, OpenAIProvider, StubProvider
+from output_schema import RESULT_SCHEMA, RESULTS_LIST_SCHEMA, parse_result, parse_results_list
+from http_client import PooledClient
+from router import BackendRouter
+from local_ner import LocalExtractor
+from scheduler import MicroBatcher
+import requests
+import json
+import logging
+import os
+
+# Classification core shared by the Flask server (server.py, server-chatgpt.py) and the async server (server_async.py).
+# Every provider goes through the same cache, scheduler, validation and metrics below.
+
+# --- Provider Selection: "ollama", "openai" or "stub"; a request may pick another one with a "provider" field ---
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "ollama")
+
+# --- Hard Cases: a message whose reply from its provider is unusable is retried on this one instead (e.g. "openai") ---
+HARD_CASE_PROVIDER = os.getenv("LLM_HARD_CASE_PROVIDER")
+
+# --- Ollama Backends: one or more inference hosts (comma-separated in OLLAMA_BACKENDS), routed by least outstanding requests ---
+OLLAMA_BACKENDS = os.getenv("OLLAMA_BACKENDS", "http://192.168.88.234:11434").split(",")
+# OLLAMA_BACKENDS = ["http://localhost:11434"]
+OLLAMA_GENERATE_PATH = "/api/generate"
+
+# --- Backend Health: consecutive failures before a host is ejected, ejection time, and /api/tags check interval ---
+BACKEND_EJECT_AFTER = 2
+BACKEND_EJECT_SECONDS = 30.0
+BACKEND_HEALTH_INTERVAL = 10.0
+
+OLLAMA_MODEL = "gemma2:9b"
+
+# --- Prompt Prefix Reuse: the NER rules go in Ollama's "system" field so every request shares the same templated
+#     prefix, which the runner keeps in its KV cache; keep_alive stops the model (and that cache) being unloaded ---
+OLLAMA_KEEP_ALIVE = "30m"
+
+# --- Context Window: sent on every Ollama call (a different num_ctx per request would reload the model). Sized for a
+#     /reply_thread window: ~710-token system prompt + the plugin's THREAD_WINDOW_TOKENS (input and reply) + margin ---
+OLLAMA_NUM_CTX = 4096
+
+# --- Structured Output: the 17-key JSON schema is passed as Ollama's "format" (constrained decoding); replies are still
+#     validated and near-misses repaired locally, and only unusable replies get one targeted retry ---
+#     (OpenAI gets the same schema as response_format json_schema)
+STRUCTURED_OUTPUT = True
+OUTPUT_RETRY_ENABLED = True
+
+output_quality = OutputQuality()
+
+# --- Upstream HTTP Client: shared keep-alive pool with connect/read timeouts and retry with backoff on 5xx/resets ---
+OLLAMA_POOL_SIZE = 16
+OLLAMA_CONNECT_TIMEOUT = 5.0
+OLLAMA_READ_TIMEOUT = 120.0
+OLLAMA_MAX_RETRIES = 3 if len(OLLAMA_BACKENDS) == 1 else 1  # with several hosts, fail over instead of retrying the same one
+
+ollama_client = PooledClient(OLLAMA_POOL_SIZE, OLLAMA_MAX_RETRIES, 0.5, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)
+ollama_router = BackendRouter(ollama_client, OLLAMA_BACKENDS, BACKEND_EJECT_AFTER, BACKEND_EJECT_SECONDS,
+                              health_interval=BACKEND_HEALTH_INTERVAL)
+if len(OLLAMA_BACKENDS) > 1:
+    ollama_router.start_health_checks()
+
+# --- OpenAI Chat Completions (base URL overridable for proxies and local mocks) ---
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") or ""
+OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+OPENAI_MODEL = "gpt-4o-mini"
+
+openai_client = PooledClient(pool_size=16, max_retries=3, backoff_factor=0.5, connect_timeout=5.0, read_timeout=60.0)
+
+providers = {
+    "ollama": OllamaProvider(OLLAMA_MODEL, ollama_router, ollama_client, OLLAMA_GENERATE_PATH, OLLAMA_KEEP_ALIVE, STRUCTURED_OUTPUT,
+                             OLLAMA_NUM_CTX),
+    "openai": OpenAIProvider(OPENAI_MODEL, OPENAI_API_URL, OPENAI_API_KEY, openai_client),
+    "stub": StubProvider("stub"),
+}
+
+def get_provider(name=None):
+    return providers[name or LLM_PROVIDER]
+
+# --- Result Cache Configuration: on-disk SQLite store shared across cases, with size and age limits ---
+CACHE_ENABLED = True
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "classification_cache.db"))
+CACHE_MAX_ENTRIES = 200000
+CACHE_MAX_AGE_SECONDS = 90 * 24 * 3600
+
+result_cache = ResultCache(CACHE_PATH, CACHE_MAX_ENTRIES, CACHE_MAX_AGE_SECONDS) if CACHE_ENABLED else None
+
+# --- Parallel Ollama calls used when a batch or thread window is classified message by message ---
+BATCH_CONCURRENCY = 4
+
+# --- Cascade Mode: a local regex/gazetteer (or spaCy, if SPACY_MODEL is installed) pass answers confident messages on CPU;
+#     only messages with weak TAGS evidence or unexplained names are sent to the LLM. Same 17-key JSON either way ---
+CASCADE_ENABLED = False
+SPACY_MODEL = os.getenv("SPACY_MODEL")  # e.g. "en_core_web_sm"; optional
+CASCADE_MIN_TAG_HITS = 2
+CASCADE_MAX_WORDS = 60
+
+local_extractor = LocalExtractor(spacy_model=SPACY_MODEL, min_tag_hits=CASCADE_MIN_TAG_HITS,
+                                 max_words=CASCADE_MAX_WORDS) if CASCADE_ENABLED else None
+
+# --- Micro-Batching Scheduler: cache misses from concurrent requests are grouped for up to MICROBATCH_MAX_WAIT_MS ---
+#     "parallel": each group is sent as parallel single-message calls, sized to OLLAMA_NUM_PARALLEL slots per backend
+#     "prompt":   each group is sent as one numbered multi-message prompt and the results are split back per caller
+MICROBATCH_ENABLED = True
+MICROBATCH_MODE = "parallel"
+MICROBATCH_MAX_WAIT_MS = 20
+MICROBATCH_PROMPT_MAX_MESSAGES = 8
+OLLAMA_NUM_PARALLEL = 4
+UPSTREAM_SLOTS = OLLAMA_NUM_PARALLEL * len(OLLAMA_BACKENDS)
+
+# One pool for the parallel-mode calls of every batch, so total upstream concurrency stays at UPSTREAM_SLOTS
+upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_SLOTS, thread_name_prefix="upstream")
+
+
+# --- System Message with NER Extraction Rules and JSON Output Format (also part of the cache key) ---
+SYSTEM_MESSAGE = """
+    You are a expert digital forensic assistant that extracts information into strict JSON format according to the specified spaCy NER categories.
+
+    The entity categories are:
+
+    - **PERSON**: Any individual or entity that represents a person or their unique role.  
+    - **ORG**: Any organization such as companies, agencies, or institutions.  
+    - **GPE**: Geopolitical entities such as countries, cities, or regions.  
+    - **NORP**: Nationalities, religious or political groups.  
+    - **DATE**: Calendar dates or ranges.  
+    - **TIME**: Specific times of the day or durations.  
+    - **MONEY**: Monetary values.  
+    - **PERCENT**: Percentages or rates.  
+    - **FAC**: Buildings, airports, highways, or other man-made structures.  
+    - **PRODUCT**: Products or goods, including inventions or creations.  
+    - **WORK_OF_ART**: Works of art like books, music, films, etc.  
+    - **LANGUAGE**: Any languages.  
+    - **EVENT**: Events like sports events, concerts, festivals, etc.  
+    - **LAW**: Legal documents or terms.  
+    - **ORDINAL**: Ordinal numbers like 'first', 'second'.  
+    - **CARDINAL**: Cardinal numbers like 'one', 'two', 'hundred'.  
+    - **TAGS**: One or more keywords that capture the essence or context of the message in one word. These should summarize the message topic or intent, like “BANK” for banking transactions, “PURCHASE” for buying goods, or “SCHOOL” for education-related matters. Multiple tags can be provided if needed to better reflect the context of the message.
+
+    ### Output Rules:
+    1. Your response **must** only contain JSON formatted data.
+    2. Each entity should be represented with its exact category label as provided.
+    3. If an entity is not present, use "-" as the value. **Do not skip or leave blank.**
+    4. Ensure no trailing commas or syntax errors in the JSON.
+    5. Validate the structure before responding. 
+
+    You reply to this in JSON format as follows strictly:
+    {"PERSON": "xxx","ORG": "xxx","GPE": "xxx","NORP": "xxx","DATE": "xxx","TIME": "xxx","MONEY": "xxx","PERCENT": "xxx","FAC": "xxx","PRODUCT": "xxx","WORK_OF_ART": "xxx","LANGUAGE": "xxx","EVENT": "xxx","LAW": "xxx","ORDINAL": "xxx","CARDINAL": "xxx","TAGS": "xxx"}
+    The "xxx" is replaced by your answer in text format. 
+    Failure to strictly adhere to this format will result in the output being unusable. Validate for correctness before replying and ensure there are no errors.
+    """
+
+# --- Extra Instructions for Conversation Windows: same NER rules, one result per numbered message ---
+THREAD_SYSTEM_MESSAGE = SYSTEM_MESSAGE + """
+    ### Conversation Mode:
+    The user message is a window of consecutive messages from one conversation, numbered [1], [2], [3] and so on.
+    Use the other messages only as context; extract the entities of each numbered message separately.
+    Reply with a JSON object {"results": [...]} holding exactly one object per numbered message, in the same order, each in the format above.
+    """
+
+# --- Extra Instructions for Micro-Batched Prompts: unrelated messages from different requests in one prompt ---
+MULTI_SYSTEM_MESSAGE = SYSTEM_MESSAGE + """
+    ### Batch Mode:
+    The user message holds several unrelated messages, numbered [1], [2], [3] and so on.
+    Treat every numbered message on its own; never carry entities over from one message to another.
+    Reply with a JSON object {"results": [...]} holding exactly one object per numbered message, in the same order, each in the format above.
+    """
+
+# --- Conversation Window Classification: one prompt per window, falling back to per-message calls if the reply doesn't line up ---
+def classify_thread_window(messages, provider=None):
+    try:
+        response = get_model_response(number_messages(messages), THREAD_SYSTEM_MESSAGE, RESULTS_LIST_SCHEMA, provider)
+    except requests.RequestException as e:
+        log_event("upstream_error", logging.WARNING, error=type(e).__name__, detail=str(e))
+        response = None
+
+    results, status = parse_results_list(response, len(messages))
+    output_quality.record(status)
+    if results is not None:
+        return results
+
+    log_event("thread_window_fallback", logging.WARNING, messages=len(messages))
+    return classify_batch(messages, provider)
+
+def number_messages(messages):
+    return "\n".join(f"[{i}] {' '.join(str(m).split())}" for i, m in enumerate(messages, 1))
+
+# --- Cache-Aware Classification: local cascade first (if enabled), then a stored reply, otherwise Ollama ---
+# Returns the validated 17-key result as a JSON string, or None when the model gave no usable reply.
+def classify_message(user_message, provider=None):
+    if local_extractor is not None:
+        result, reason = local_extractor.extract(user_message)
+        if reason is None:
+            return json.dumps(result)
+
+    provider = provider or LLM_PROVIDER
+    if result_cache is None:
+        result, _ = request_classification(user_message, provider)
+        return json.dumps(result) if result is not None else None
+
+    model = get_provider(provider).model
+    key = ResultCache.make_key(user_message, model, SYSTEM_MESSAGE)
+    keys = [key]
+    if HARD_CASE_PROVIDER and HARD_CASE_PROVIDER != provider:
+        # a message escalated before is answered from its hard-case reply instead of failing on the primary again
+        keys.append(ResultCache.make_key(user_message, get_provider(HARD_CASE_PROVIDER).model, SYSTEM_MESSAGE))
+    cached = result_cache.get_first(keys)
+    if cached is not None:
+        return cached
+
+    result, source = request_classification(user_message, provider)
+    if result is None:
+        return None
+    response = json.dumps(result)
+    if source != provider:
+        # escalated reply: cached under the model that wrote it, never as the primary model's answer
+        model = get_provider(source).model
+        key = ResultCache.make_key(user_message, model, SYSTEM_MESSAGE)
+    result_cache.put(key, model, response)
+    return response
+
+# --- Upstream Call for a Cache Miss: goes through the micro-batching scheduler when it is enabled ---
+# Returns (result or None, name of the provider that produced it).
+def request_classification(user_message, provider):
+    if microbatcher is None:
+        return get_checked_result(user_message, provider)
+    return microbatcher.submit((user_message, provider)).result()
+
+# --- One Message, Validated: repairs near-miss JSON locally and retries once, with a correction note, only if that fails;
+#     the retry goes to HARD_CASE_PROVIDER when one is configured. Returns (result or None, provider that answered) ---
+def get_checked_result(user_message, provider):
+    response = get_model_response(user_message, provider=provider)
+    result, status = parse_result(response)
+    output_quality.record(status)
+    if result is not None or not OUTPUT_RETRY_ENABLED:
+        return result, provider
+
+    retry_provider = HARD_CASE_PROVIDER or provider
+    log_event("output_retry", logging.WARNING, provider=provider, retry_provider=retry_provider, **text_field(response, "reply"))
+    retry_message = (f"{user_message}\n\n(Your previous reply could not be used. Reply with only the JSON object "
+                     f"containing all 17 keys, using \"-\" for missing values.)")
+    response = get_model_response(retry_message, provider=retry_provider)
+    result, status = parse_result(response)
+    output_quality.record(status)
+    output_quality.record_retry(result is not None)
+    return result, retry_provider
+
+# --- Scheduler Batch Handlers: items are (message, provider) pairs; one (validated result or None, provider that
+#     answered) pair per item, in order ---
+def classify_group_parallel(items):
+    return list(upstream_executor.map(lambda item: safe_checked_result(*item), items))
+
+def classify_group_prompt(items):
+    by_provider = {}
+    for index, (message, provider) in enumerate(items):
+        by_provider.setdefault(provider, []).append(index)
+    results = [None] * len(items)
+    for provider, indexes in by_provider.items():
+        group = [items[i][0] for i in indexes]
+        for i, result in zip(indexes, classify_prompt_group(group, provider)):
+            results[i] = result
+    return results
+
+def classify_prompt_group(messages, provider):
+    if len(messages) == 1:
+        return [safe_checked_result(messages[0], provider)]
+    try:
+        response = get_model_response(number_messages(messages), MULTI_SYSTEM_MESSAGE, RESULTS_LIST_SCHEMA, provider)
+    except requests.RequestException as e:
+        log_event("upstream_error", logging.WARNING, provider=provider, error=type(e).__name__, detail=str(e))
+        response = None
+
+    results, status = parse_results_list(response, len(messages))
+    output_quality.record(status)
+    if results is not None:
+        return [(result, provider) for result in results]
+
+    log_event("microbatch_fallback", logging.WARNING, provider=provider, messages=len(messages))
+    return classify_group_parallel([(message, provider) for message in messages])
+
+def safe_checked_result(user_message, provider):
+    try:
+        return get_checked_result(user_message, provider)
+    except requests.RequestException as e:
+        log_event("upstream_error", logging.WARNING, provider=provider, error=type(e).__name__, detail=str(e))
+        return None, provider
+
+# --- Send One Prompt to a Provider (default LLM_PROVIDER) and Return the Raw Model Reply ---
+def get_model_response(user_message, system_message=SYSTEM_MESSAGE, schema=RESULT_SCHEMA, provider=None):
+    return get_provider(provider).generate(user_message, system_message, schema)
+
+# --- Helper Function to Classify One Message and Parse the Model's JSON Reply ---
+def get_structured_response(message, provider=None):
+    if not message:
+        return None
+    try:
+        response = classify_message(message, provider)
+    except requests.RequestException as e:
+        log_event("upstream_error", logging.WARNING, error=type(e).__name__, detail=str(e))
+        return None
+    return parse_result(response)[0]
+
+# --- Batch Classification: parallel per-message calls, one parsed result (or None) per message in the same order ---
+def classify_batch(messages, provider=None):
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+        return list(executor.map(lambda message: get_structured_response(message, provider), messages))
+
+# --- Snapshot of cache, upstream timing and connection pool statistics ---
+def classifier_stats():
+    return {
+        'provider': LLM_PROVIDER,
+        'hard_case_provider': HARD_CASE_PROVIDER,
+        'cache': result_cache.stats() if result_cache is not None else None,
+        'providers': {name: provider.stats() for name, provider in providers.items()},
+        'output': output_quality.snapshot(),
+        'cascade': local_extractor.stats() if local_extractor is not None else None,
+        'microbatch': dict(microbatcher.stats(), mode=MICROBATCH_MODE) if microbatcher is not None else None,
+    }
+
+# --- Prometheus Series for the Classification Core: upstream timings and tokens, cache, queue, backends, errors ---
+def write_prometheus(writer):
+    # one family at a time so the samples of each metric stay together, labelled by provider
+    for name, provider in providers.items():
+        writer.histogram("upstream_prompt_eval_seconds", "Model prompt_eval_duration per call (prefill)", provider.timings.prompt_eval_histogram, provider=name)
+    for name, provider in providers.items():
+        writer.histogram("upstream_eval_seconds", "Model eval_duration per call (generation)", provider.timings.eval_histogram, provider=name)
+    for name, provider in providers.items():
+        writer.histogram("upstream_total_seconds", "Model total_duration per call", provider.timings.total_histogram, provider=name)
+    timings = {name: provider.timings.snapshot() for name, provider in providers.items()}
+    for name, snapshot in timings.items():
+        writer.counter("upstream_calls_total", "Successful model calls", snapshot["requests"], provider=name)
+    for name, snapshot in timings.items():
+        writer.counter("upstream_prompt_tokens_total", "Prompt tokens evaluated", snapshot["prompt_tokens"], provider=name)
+    for name, snapshot in timings.items():
+        writer.counter("upstream_eval_tokens_total", "Tokens generated", snapshot["eval_tokens"], provider=name)
+    for name, snapshot in timings.items():
+        writer.gauge("upstream_eval_tokens_per_second", "Generated tokens per second of eval time", snapshot["eval_tokens_per_second"], provider=name)
+    for name, snapshot in timings.items():
+        writer.gauge("upstream_prompt_tokens_per_second", "Prompt tokens per second of prompt_eval time", snapshot["prompt_tokens_per_second"], provider=name)
+
+    if result_cache is not None:
+        cache = result_cache.stats()
+        writer.counter("cache_hits_total", "Result cache hits", cache["hits"])
+        writer.counter("cache_misses_total", "Result cache misses", cache["misses"])
+        writer.gauge("cache_hit_ratio", "Result cache hits / lookups", cache["hit_rate"])
+        writer.gauge("cache_entries", "Entries in the result cache", cache["entries"])
+
+    if microbatcher is not None:
+        writer.gauge("queue_depth", "Messages waiting in the micro-batching scheduler", microbatcher.stats()["queue_depth"])
+        writer.histogram("microbatch_size", "Messages per micro-batch", microbatcher.batch_sizes)
+        writer.histogram("microbatch_queue_wait_seconds", "Time a message waits before its batch is dispatched", microbatcher.queue_wait)
+
+    backends = ollama_router.stats()["backends"]
+    for backend in backends:
+        writer.gauge("backend_outstanding", "Requests in flight per Ollama backend", backend["outstanding"], backend=backend["url"])
+    for backend in backends:
+        writer.gauge("backend_healthy", "1 if the backend is in rotation", int(backend["healthy"]), backend=backend["url"])
+
+    quality = output_quality.snapshot()
+    for status in ("valid", "repaired", "invalid"):
+        writer.counter("output_replies_total", "Model replies by validation outcome", quality[status], status=status)
+    writer.gauge("output_wasted_call_ratio", "Unusable replies / upstream calls", quality["wasted_call_rate"])
+
+    for name, provider in providers.items():
+        for error_class, count in sorted(provider.errors.snapshot().items()):
+            writer.counter("errors_total", "Errors by class", count, error_class=error_class, provider=name)
+    writer.counter("errors_total", "Errors by class", quality["invalid"], error_class="invalid_output", provider="")
+    if microbatcher is not None:
+        writer.counter("errors_total", "Errors by class", microbatcher.errors, error_class="scheduler", provider="")
+
+    if local_extractor is not None:
+        cascade = local_extractor.stats()
+        writer.counter("cascade_local_total", "Messages answered by the local extractor", cascade["local"])
+        for reason, count in sorted(cascade["escalated"].items()):
+            writer.counter("cascade_escalated_total", "Messages sent on to the LLM by reason", count, reason=reason)
+
+# --- Scheduler Instance: prompt mode groups up to MICROBATCH_PROMPT_MAX_MESSAGES per prompt, parallel mode one per backend slot;
+#     parallel mode keeps UPSTREAM_SLOTS batches in flight so a new group never waits for the slowest call of the last one ---
+if not MICROBATCH_ENABLED:
+    microbatcher = None
+elif MICROBATCH_MODE == "prompt":
+    microbatcher = MicroBatcher(classify_group_prompt, MICROBATCH_PROMPT_MAX_MESSAGES, MICROBATCH_MAX_WAIT_MS / 1000, UPSTREAM_SLOTS)
+else:
+    microbatcher = MicroBatcher(classify_group_parallel, UPSTREAM_SLOTS, MICROBATCH_MAX_WAIT_MS / 1000, UPSTREAM_SLOTS)
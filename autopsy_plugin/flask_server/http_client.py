@@ -0,0 +1,73 @@
+# --- Imports: requests session with urllib3 connection pooling and retry policy ---
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# --- Pooled Keep-Alive Client for Upstream Model APIs ---
+class PooledClient:
+    """
+    One shared requests.Session per upstream: connections are kept alive and
+    reused across Flask worker threads instead of a TCP (and TLS) setup per SMS.
+    5xx replies and connection resets are retried with exponential backoff.
+    """
+
+    def __init__(self, pool_size=16, max_retries=3, backoff_factor=0.5, connect_timeout=5.0, read_timeout=120.0):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "POST"]),
+            raise_on_status=False,
+            respect_retry_after_header=False,  # 429 + Retry-After is handled by the providers, not the transport
+        )
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        with self._lock:
+            self.requests += 1
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self.errors += 1
+            raise
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    # --- Per-host pool statistics: connections opened vs requests sent shows the keep-alive reuse rate ---
+    def stats(self):
+        pools = []
+        manager = self.adapter.poolmanager
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            requests_sent = pool.num_requests
+            pools.append({
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "connections_opened": pool.num_connections,
+                "requests": requests_sent,
+                "reuse_rate": (1 - pool.num_connections / requests_sent) if requests_sent else 0.0,
+                "idle_connections": pool.pool.qsize() if pool.pool is not None else 0,
+                "max_connections": self.adapter._pool_maxsize,
+            })
+        return {"requests": self.requests, "errors": self.errors, "timeout": list(self.timeout), "pools": pools}
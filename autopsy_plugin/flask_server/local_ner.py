@@ -0,0 +1,175 @@
+# --- Local NER for the cascade: regex and gazetteer extraction on CPU, spaCy when it is installed ---
+import json
+import os
+import re
+import logging
+import threading
+
+from output_schema import ENTITY_KEYS
+from request_log import log_event
+
+try:
+    import spacy
+except ImportError:
+    spacy = None
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.json")
+
+# --- Numeric Entity Patterns (applied in this order; an earlier match claims its characters) ---
+_MONTHS = r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)"
+_CURRENCY = r"(?:rs\.?|inr|aed|usd|sgd|myr|rm|eur|gbp|dhs?|₹|\$|£|€)"
+_NUMBER = r"\d[\d,]*(?:\.\d+)?"
+
+PATTERNS = [
+    ("MONEY", re.compile(rf"(?<!\w){_CURRENCY}\s?{_NUMBER}|\b{_NUMBER}\s?(?:rupees|dollars|dirhams|ringgit|euros?|pounds|{_CURRENCY})(?!\w)", re.I)),
+    ("PERCENT", re.compile(rf"\b{_NUMBER}\s?(?:%|per\s?cent\b)", re.I)),
+    ("DATE", re.compile(
+        rf"\b\d{{4}}-\d{{2}}-\d{{2}}\b"
+        rf"|\b\d{{1,2}}[-/.]\d{{1,2}}[-/.]\d{{2,4}}\b"
+        rf"|\b\d{{1,2}}(?:st|nd|rd|th)?[-\s]?{_MONTHS}\b(?:[-\s,]+\d{{2,4}}\b)?"
+        rf"|\b{_MONTHS}\s\d{{1,2}}(?:st|nd|rd|th)?\b(?:,?\s\d{{4}}\b)?"
+        rf"|\b{_MONTHS}[-']\d{{2,4}}\b"
+        rf"|\b(?:today|tomorrow|yesterday|(?:mon|tues|wednes|thurs|fri|satur|sun)day|weekend|next week|last week|this week)\b", re.I)),
+    ("TIME", re.compile(
+        rf"\b\d{{1,2}}:\d{{2}}(?::\d{{2}})?(?:\s?(?:am|pm|hrs|hours)\b)?"
+        rf"|\b\d{{1,2}}\.\d{{2}}\s?(?:am|pm)\b"
+        rf"|\b\d{{1,2}}\s?(?:am|pm)\b"
+        rf"|\b\d+\s?(?:mins?|minutes|hours|hrs|seconds|secs)\b"
+        rf"|\b(?:tonight|this morning|this afternoon|this evening|noon|midnight)\b", re.I)),
+    ("ORDINAL", re.compile(r"\b\d+(?:st|nd|rd|th)\b|\b(?:first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|tenth)\b", re.I)),
+    ("CARDINAL", re.compile(rf"\b{_NUMBER}\b|\b(?:one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|hundred|thousand|lakh|crore|million)\b", re.I)),
+]
+
+_URL_RE = re.compile(r"(?:https?://|www\.)\S+|\b[\w.-]+\.(?:com|in|me|co|net|org|ly|ae)(?:/\S*)?|\S+@\S+", re.I)
+_CAPITALISED_RE = re.compile(r"\b[A-Z][A-Za-z&'-]+\b")
+_SENTENCE_START_RE = re.compile(r"(?:^|[.!?:;\"(]\s*|\n)$")
+
+# --- Everyday and SMS-boilerplate words that are often capitalised but are not names ---
+COMMON_WORDS = set("""
+a about above after again all also am an and any are as at available avl avlbl balance be been before below best
+bal by call can card charges click code coming complete congratulations continue credit customer daily data dear debit
+do dont don't download enjoy enter for from get go good got had has have hello hey hi hrs how i if in info is it its
+just kindly know last let limited like login make may me minutes mobile more my new no not note now number of off on
+one only or our out over pay payment per plan please pls reply report sent service services sms so sorry stop t&c
+thank thanks that the then there this to today total tomorrow txn u ur update use user valid visit was we welcome
+well what when where which will with yes you your yours dial get use via id ref no. xx xxxx avoid amt amount transaction
+inr aed usd rs rm sgd eur gbp okay ok oh haha hahaha lol yeah yup nope maybe vpa mob gb mb remittance avail pm am
+stoppage consumer dr cr withdrawal app voice online stock unauthorized unauthorised day one-time pin min open alert
+alerts ac sb paid zero fresh pos deposit lacs lakh minimum redeem home temporary credits plus flat free save important
+dear sir madam customer ref refno txn hi hello urgent
+""".split())
+
+
+# --- Gazetteer: ORG/GPE/NORP/LANGUAGE name lists and TAGS keyword lists, matched as whole words, longest first ---
+def _phrase_pattern(phrases):
+    ordered = sorted(set(phrases), key=len, reverse=True)
+    return re.compile(r"(?<!\w)(?:" + "|".join(re.escape(p) for p in ordered) + r")(?!\w)", re.I)
+
+
+def load_gazetteer(path=GAZETTEER_PATH):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    names = {label: _phrase_pattern(phrases) for label, phrases in data.items() if label != "TAGS" and phrases}
+    tags = {tag: _phrase_pattern(keywords) for tag, keywords in data.get("TAGS", {}).items()}
+    known = set()
+    for label, phrases in data.items():
+        for phrase in (phrases if label != "TAGS" else [k for keywords in phrases.values() for k in keywords]):
+            known.update(phrase.lower().split())
+    return names, tags, known
+
+
+# --- Cascade Extractor: returns the 17-key result and, if the message still needs the LLM, the reason why ---
+class LocalExtractor:
+    """
+    DATE/TIME/MONEY/PERCENT/ORDINAL/CARDINAL come from regexes, ORG/GPE/NORP/LANGUAGE
+    from the gazetteer (or from spaCy when a model is configured) and TAGS from
+    keyword lists. A message is answered locally only when it has enough TAGS
+    evidence, is short, and has no capitalised word left unexplained (a likely
+    PERSON/ORG/GPE the regexes cannot resolve); everything else goes to the LLM.
+    """
+
+    def __init__(self, gazetteer_path=GAZETTEER_PATH, spacy_model=None, min_tag_hits=2, max_words=60):
+        self.names, self.tags, self.known_words = load_gazetteer(gazetteer_path)
+        self.min_tag_hits = min_tag_hits
+        self.max_words = max_words
+        self.nlp = None
+        if spacy is not None and spacy_model:
+            try:
+                self.nlp = spacy.load(spacy_model, disable=["parser", "lemmatizer"])
+            except OSError as e:
+                log_event("spacy_unavailable", logging.WARNING, model=spacy_model, detail=str(e))
+
+        self._lock = threading.Lock()
+        self.local = 0
+        self.escalated = {}
+
+    def extract(self, message):
+        text = " ".join(str(message).split())
+        masked = _URL_RE.sub(lambda m: " " * len(m.group(0)), text)
+        found = {key: [] for key in ENTITY_KEYS}
+        claimed = [False] * len(masked)
+
+        def claim(label, match):
+            start, end = match.span()
+            if any(claimed[start:end]):
+                return
+            for i in range(start, end):
+                claimed[i] = True
+            found[label].append(match.group(0).strip())
+
+        for label, pattern in self.names.items():
+            for match in pattern.finditer(masked):
+                claim(label, match)
+        # TAGS keywords such as "one time password" claim their words so the numeric patterns skip them
+        tag_hits = 0
+        for tag, pattern in self.tags.items():
+            matches = list(pattern.finditer(masked))
+            if matches:
+                found["TAGS"].append(tag)
+                tag_hits += len(matches)
+                for match in matches:
+                    start, end = match.span()
+                    claimed[start:end] = [True] * (end - start)
+        for label, pattern in PATTERNS:
+            for match in pattern.finditer(masked):
+                claim(label, match)
+        if self.nlp is not None:
+            for ent in self.nlp(masked).ents:
+                if ent.label_ in found and not any(claimed[ent.start_char:ent.end_char]):
+                    found[ent.label_].append(ent.text)
+
+        result = {key: ", ".join(dict.fromkeys(values)) if values else "-" for key, values in found.items()}
+        reason = self._escalation_reason(masked, claimed, tag_hits)
+        with self._lock:
+            if reason is None:
+                self.local += 1
+            else:
+                self.escalated[reason] = self.escalated.get(reason, 0) + 1
+        return result, reason
+
+    def _escalation_reason(self, masked, claimed, tag_hits):
+        if not masked.strip():
+            return "empty"
+        if len(masked.split()) > self.max_words:
+            return "long"
+        if tag_hits < self.min_tag_hits:
+            return "tags"
+        if self.nlp is None:
+            for match in _CAPITALISED_RE.finditer(masked):
+                word = match.group(0).lower()
+                if claimed[match.start()] or word in COMMON_WORDS or word in self.known_words:
+                    continue
+                if _SENTENCE_START_RE.search(masked[:match.start()]):
+                    continue
+                return "proper_noun"
+        return None
+
+    def stats(self):
+        with self._lock:
+            total = self.local + sum(self.escalated.values())
+            return {
+                "local": self.local,
+                "escalated": dict(self.escalated),
+                "local_rate": (self.local / total) if total else 0.0,
+                "spacy": self.nlp is not None,
+            }
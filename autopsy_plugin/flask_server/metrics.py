@@ -0,0 +1,215 @@
+# --- Imports: threading for counters shared by Flask worker threads ---
+import threading
+
+
+NANOSECONDS = 1e9
+
+# --- Histogram bucket bounds (seconds) for model calls and for whole HTTP requests ---
+UPSTREAM_LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120]
+REQUEST_LATENCY_BUCKETS = [0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+# --- Upstream Timing Accumulator: sums the timing fields Ollama returns with every non-streaming reply ---
+class UpstreamTimings:
+    """
+    Tracks prompt evaluation (prefill) against generation (eval) time. When the
+    system prompt prefix is reused from Ollama's KV cache, prompt_eval_count and
+    prompt_eval_duration only cover the new user-message tokens.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.prompt_eval_seconds = 0.0
+        self.eval_tokens = 0
+        self.eval_seconds = 0.0
+        self.load_seconds = 0.0
+        self.total_seconds = 0.0
+        self.prompt_eval_histogram = Histogram(UPSTREAM_LATENCY_BUCKETS)
+        self.eval_histogram = Histogram(UPSTREAM_LATENCY_BUCKETS)
+        self.total_histogram = Histogram(UPSTREAM_LATENCY_BUCKETS)
+
+    def record(self, response_data):
+        prompt_eval = response_data.get("prompt_eval_duration", 0) / NANOSECONDS
+        evaluation = response_data.get("eval_duration", 0) / NANOSECONDS
+        total = response_data.get("total_duration", 0) / NANOSECONDS
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += response_data.get("prompt_eval_count", 0)
+            self.prompt_eval_seconds += prompt_eval
+            self.eval_tokens += response_data.get("eval_count", 0)
+            self.eval_seconds += evaluation
+            self.load_seconds += response_data.get("load_duration", 0) / NANOSECONDS
+            self.total_seconds += total
+        self.prompt_eval_histogram.observe(prompt_eval)
+        self.eval_histogram.observe(evaluation)
+        self.total_histogram.observe(total)
+
+    def snapshot(self):
+        with self._lock:
+            requests = self.requests or 1
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "prompt_tokens_per_request": self.prompt_tokens / requests,
+                "avg_prompt_eval_ms": 1000 * self.prompt_eval_seconds / requests,
+                "eval_tokens": self.eval_tokens,
+                "avg_eval_ms": 1000 * self.eval_seconds / requests,
+                "eval_tokens_per_second": (self.eval_tokens / self.eval_seconds) if self.eval_seconds else 0.0,
+                "prompt_tokens_per_second": (self.prompt_tokens / self.prompt_eval_seconds) if self.prompt_eval_seconds else 0.0,
+                "avg_load_ms": 1000 * self.load_seconds / requests,
+                "avg_total_ms": 1000 * self.total_seconds / requests,
+            }
+
+
+# --- Cumulative Histogram: fixed upper bounds, Prometheus-style "le" buckets plus count and sum ---
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self._lock = threading.Lock()
+        self._counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+
+    def samples(self):
+        with self._lock:
+            return list(zip(self.buckets, self._counts)), self.count, self.sum
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "buckets": {str(bound): count for bound, count in zip(self.buckets, self._counts)},
+                "count": self.count,
+                "sum": self.sum,
+                "mean": (self.sum / self.count) if self.count else 0.0,
+            }
+
+
+# --- Output Quality: how many upstream replies were valid, repaired locally, or unusable (a wasted model call) ---
+class OutputQuality:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.statuses = {"valid": 0, "repaired": 0, "invalid": 0}
+        self.retries = 0
+        self.retries_recovered = 0
+
+    def record(self, status):
+        with self._lock:
+            self.calls += 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def record_retry(self, recovered):
+        with self._lock:
+            self.retries += 1
+            if recovered:
+                self.retries_recovered += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "valid": self.statuses["valid"],
+                "repaired": self.statuses["repaired"],
+                "invalid": self.statuses["invalid"],
+                "retries": self.retries,
+                "retries_recovered": self.retries_recovered,
+                "wasted_call_rate": (self.statuses["invalid"] / self.calls) if self.calls else 0.0,
+            }
+
+
+# --- Per-Endpoint Request Counts (by status) and Request Duration ---
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+        self.latency = {}
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            self.counts[(endpoint, status)] = self.counts.get((endpoint, status), 0) + 1
+            histogram = self.latency.get(endpoint)
+            if histogram is None:
+                histogram = self.latency[endpoint] = Histogram(REQUEST_LATENCY_BUCKETS)
+        histogram.observe(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return [{"endpoint": e, "status": s, "count": n} for (e, s), n in sorted(self.counts.items())]
+
+    def write_prometheus(self, writer):
+        with self._lock:
+            counts = sorted(self.counts.items())
+            latency = sorted(self.latency.items())
+        for (endpoint, status), count in counts:
+            writer.counter("requests_total", "HTTP requests by endpoint and status", count, endpoint=endpoint, status=status)
+        for endpoint, histogram in latency:
+            writer.histogram("request_duration_seconds", "HTTP request duration by endpoint", histogram, endpoint=endpoint)
+
+
+# --- Error Classes: upstream exception types, upstream HTTP statuses and other failures, counted by name ---
+class ErrorCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def record(self, error_class):
+        with self._lock:
+            self.counts[error_class] = self.counts.get(error_class, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+# --- Prometheus Text Exposition (format 0.0.4) without a client library dependency ---
+class PrometheusWriter:
+    def __init__(self, prefix="llm_dfir_"):
+        self.prefix = prefix
+        self._lines = []
+        self._declared = set()
+
+    def _declare(self, name, kind, help_text):
+        if name not in self._declared:
+            self._declared.add(name)
+            self._lines.append(f"# HELP {name} {help_text}")
+            self._lines.append(f"# TYPE {name} {kind}")
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+        return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels.keys(), escaped)) + "}"
+
+    def counter(self, name, help_text, value, **labels):
+        name = self.prefix + name
+        self._declare(name, "counter", help_text)
+        self._lines.append(f"{name}{self._labels(labels)} {value}")
+
+    def gauge(self, name, help_text, value, **labels):
+        name = self.prefix + name
+        self._declare(name, "gauge", help_text)
+        self._lines.append(f"{name}{self._labels(labels)} {value}")
+
+    def histogram(self, name, help_text, histogram, **labels):
+        name = self.prefix + name
+        self._declare(name, "histogram", help_text)
+        buckets, count, total = histogram.samples()
+        for bound, bucket_count in buckets:
+            self._lines.append(f"{name}_bucket{self._labels(dict(labels, le=f'{bound:g}'))} {bucket_count}")
+        self._lines.append(f"{name}_bucket{self._labels(dict(labels, le='+Inf'))} {count}")
+        self._lines.append(f"{name}_sum{self._labels(labels)} {total}")
+        self._lines.append(f"{name}_count{self._labels(labels)} {count}")
+
+    def text(self):
+        return "\n".join(self._lines) + "\n"
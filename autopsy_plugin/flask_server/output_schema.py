@@ -0,0 +1,127 @@
+# --- Classifier Output Schema: the 17-key result as a JSON schema, plus validation and cheap repair of near-miss replies ---
+import json
+import re
+
+ENTITY_KEYS = ["PERSON", "ORG", "GPE", "NORP", "DATE", "TIME", "MONEY", "PERCENT", "FAC", "PRODUCT",
+               "WORK_OF_ART", "LANGUAGE", "EVENT", "LAW", "ORDINAL", "CARDINAL", "TAGS"]
+
+MISSING_VALUE = "-"
+
+# --- A reply missing more keys than this (e.g. cut off mid-object) is invalid and gets the targeted retry instead ---
+MAX_MISSING_KEYS = 3
+
+# --- Structured-Output Formats: Ollama takes the schema as "format", OpenAI as response_format json_schema ---
+RESULT_SCHEMA = {
+    "type": "object",
+    "properties": {key: {"type": "string"} for key in ENTITY_KEYS},
+    "required": list(ENTITY_KEYS),
+    "additionalProperties": False,
+}
+
+RESULTS_LIST_SCHEMA = {
+    "type": "object",
+    "properties": {"results": {"type": "array", "items": RESULT_SCHEMA}},
+    "required": ["results"],
+    "additionalProperties": False,
+}
+
+
+def openai_response_format(schema=RESULT_SCHEMA, name="sms_entities"):
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.I)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_KEY_ALIASES = {key.replace("_", "").lower(): key for key in ENTITY_KEYS}
+
+
+# --- Repair: code fences, prose around the object, trailing commas, smart quotes and unclosed braces ---
+def repair_json(text):
+    text = _FENCE_RE.sub("", text.strip())
+    text = text.replace("“", '"').replace("”", '"')
+    start = min((i for i in (text.find("{"), text.find("[")) if i != -1), default=-1)
+    if start == -1:
+        return None
+    end = max(text.rfind("}"), text.rfind("]"))
+    text = text[start:end + 1] if end > start else text[start:]
+    text = _TRAILING_COMMA_RE.sub(r"\1", text)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    missing = text.count("{") - text.count("}")
+    if missing > 0:
+        try:
+            return json.loads(_TRAILING_COMMA_RE.sub(r"\1", text.rstrip().rstrip(",") + "}" * missing))
+        except json.JSONDecodeError:
+            pass
+    return None
+
+
+# --- Validation: maps key case/spelling variants, fills up to MAX_MISSING_KEYS missing keys with "-", flattens lists,
+#     drops unknown keys ---
+def normalize_result(data):
+    if not isinstance(data, dict):
+        return None, False
+    result = {}
+    changed = False
+    for key, value in data.items():
+        canonical = _KEY_ALIASES.get(str(key).replace("_", "").replace(" ", "").lower())
+        if canonical is None:
+            changed = True
+            continue
+        if isinstance(value, list):
+            value = ", ".join(str(item) for item in value if item not in (None, "")) or MISSING_VALUE
+            changed = True
+        elif value is None or value == "":
+            value = MISSING_VALUE
+            changed = True
+        elif not isinstance(value, str):
+            value = str(value)
+            changed = True
+        changed = changed or canonical != key
+        result[canonical] = value
+    if len(ENTITY_KEYS) - len(result) > MAX_MISSING_KEYS:
+        return None, False
+    if len(result) < len(ENTITY_KEYS):
+        changed = True
+    return {key: result.get(key, MISSING_VALUE) for key in ENTITY_KEYS}, changed
+
+
+# --- Parse one reply: returns (result or None, "valid" | "repaired" | "invalid") ---
+def parse_result(text):
+    if not text:
+        return None, "invalid"
+    try:
+        data = json.loads(text)
+        repaired = False
+    except json.JSONDecodeError:
+        data = repair_json(text)
+        repaired = True
+    result, changed = normalize_result(data)
+    if result is None:
+        return None, "invalid"
+    return result, "repaired" if repaired or changed else "valid"
+
+
+# --- Parse a {"results": [...]} reply for a numbered window or group; None unless it has exactly `expected` usable items ---
+def parse_results_list(text, expected):
+    if not text:
+        return None, "invalid"
+    try:
+        data = json.loads(text)
+        repaired = False
+    except json.JSONDecodeError:
+        data = repair_json(text)
+        repaired = True
+    items = data.get("results") if isinstance(data, dict) else data
+    if not isinstance(items, list) or len(items) != expected:
+        return None, "invalid"
+    results = []
+    for item in items:
+        result, changed = normalize_result(item)
+        if result is None:
+            return None, "invalid"
+        repaired = repaired or changed
+        results.append(result)
+    return results, "repaired" if repaired else "valid"
@@ -0,0 +1,172 @@
+# --- Model Providers: one interface over Ollama, OpenAI chat completions and a deterministic local stub ---
+import json
+import logging
+import re
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from metrics import UpstreamTimings, ErrorCounter
+from output_schema import ENTITY_KEYS, RESULT_SCHEMA, openai_response_format
+from request_log import log_event, text_field
+
+NUMBERED_LINE = re.compile(r"^\[(\d+)\] ", re.M)
+
+
+# --- Retry-After: delay in seconds or an HTTP date; anything unparseable falls back to the caller's backoff ---
+def retry_after_seconds(value, default):
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return default
+
+
+# --- Provider Interface: generate() returns the raw reply text, None for an upstream error reply,
+#     and raises requests.RequestException when the upstream cannot be reached ---
+class Provider:
+    name = "provider"
+
+    def __init__(self, model):
+        self.model = model
+        self.timings = UpstreamTimings()
+        self.errors = ErrorCounter()
+
+    def generate(self, user_message, system_message, schema=RESULT_SCHEMA):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"model": self.model, "timings": self.timings.snapshot(), "errors": self.errors.snapshot()}
+
+
+# --- Ollama /api/generate through the backend router (least outstanding requests, failover) ---
+class OllamaProvider(Provider):
+    name = "ollama"
+
+    def __init__(self, model, router, client, generate_path="/api/generate", keep_alive="30m", structured_output=True,
+                 num_ctx=None):
+        super().__init__(model)
+        self.router = router
+        self.client = client
+        self.generate_path = generate_path
+        self.keep_alive = keep_alive
+        self.structured_output = structured_output
+        self.num_ctx = num_ctx
+
+    def generate(self, user_message, system_message, schema=RESULT_SCHEMA):
+        data = {
+            "model": self.model,
+            "system": system_message,
+            "prompt": user_message,
+            "format": schema if self.structured_output else "json",
+            "stream": False,
+            "keep_alive": self.keep_alive
+        }
+        if self.num_ctx:
+            data["options"] = {"num_ctx": self.num_ctx}
+        try:
+            response = self.router.post(self.generate_path, headers={"Content-Type": "application/json"}, data=json.dumps(data))
+        except requests.RequestException as e:
+            self.errors.record(type(e).__name__)
+            raise
+
+        if response.status_code == 200:
+            response_data = response.json()
+            self.timings.record(response_data)
+            log_event("upstream_reply", logging.DEBUG, provider=self.name, prompt_tokens=response_data.get("prompt_eval_count"),
+                      eval_tokens=response_data.get("eval_count"), **text_field(response_data.get("response"), "reply"))
+            return response_data.get("response", "")
+        self.errors.record(f"http_{response.status_code}")
+        log_event("upstream_http_error", logging.WARNING, provider=self.name, status=response.status_code, detail=response.text[:200])
+        return None
+
+    def stats(self):
+        return dict(super().stats(), backends=self.router.stats(), http_pool=self.client.stats())
+
+
+# --- OpenAI Chat Completions with json_schema structured output; 429s wait for Retry-After before retrying ---
+class OpenAIProvider(Provider):
+    name = "openai"
+
+    def __init__(self, model, api_url, api_key, client, max_tokens=500, rate_limit_retries=3):
+        super().__init__(model)
+        self.api_url = api_url
+        self.api_key = api_key
+        self.client = client
+        self.max_tokens = max_tokens
+        self.rate_limit_retries = rate_limit_retries
+
+    # --- Chat Completions Body, shared with the offline Batch API job (batch_job.py) ---
+    def request_body(self, user_message, system_message, schema=RESULT_SCHEMA):
+        data = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": user_message}
+            ],
+            "temperature": 0.0,
+            "response_format": openai_response_format(schema)
+        }
+        if schema is RESULT_SCHEMA:
+            data["max_tokens"] = self.max_tokens
+        return data
+
+    def generate(self, user_message, system_message, schema=RESULT_SCHEMA):
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        data = self.request_body(user_message, system_message, schema)
+
+        for attempt in range(self.rate_limit_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = self.client.post(self.api_url, headers=headers, data=json.dumps(data))
+            except requests.RequestException as e:
+                self.errors.record(type(e).__name__)
+                raise
+            if response.status_code != 429 or attempt == self.rate_limit_retries:
+                break
+            self.errors.record("rate_limited")
+            time.sleep(retry_after_seconds(response.headers.get("Retry-After"), 2 ** attempt))
+
+        if response.status_code == 200:
+            body = response.json()
+            usage = body.get("usage") or {}
+            self.timings.record({
+                "prompt_eval_count": usage.get("prompt_tokens", 0),
+                "eval_count": usage.get("completion_tokens", 0),
+                "total_duration": int((time.perf_counter() - started) * 1e9),
+            })
+            return body["choices"][0]["message"]["content"]
+        self.errors.record(f"http_{response.status_code}")
+        log_event("upstream_http_error", logging.WARNING, provider=self.name, status=response.status_code, detail=response.text[:200])
+        return None
+
+    def stats(self):
+        return dict(super().stats(), http_pool=self.client.stats())
+
+
+# --- Canned Reply: every key "-" except TAGS, one object per numbered message when the prompt is a window or group;
+#     also served by the standalone stub_backend.py ---
+def stub_result(prompt):
+    result = {key: "-" for key in ENTITY_KEYS}
+    result["TAGS"] = "STUB"
+    numbered = NUMBERED_LINE.findall(prompt)
+    if numbered:
+        return {"results": [dict(result) for _ in numbered]}
+    return result
+
+
+# --- Deterministic Stub: schema-valid replies with no network or model, for tests and load runs ---
+class StubProvider(Provider):
+    name = "stub"
+
+    def generate(self, user_message, system_message, schema=RESULT_SCHEMA):
+        self.timings.record({"prompt_eval_count": len(user_message.split()), "eval_count": 0})
+        return json.dumps(stub_result(user_message))
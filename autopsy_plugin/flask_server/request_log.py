@@ -0,0 +1,64 @@
+# --- Structured Logging: one JSON line per event; requests are sampled and message text is only logged when enabled ---
+import json
+import logging
+import os
+import random
+
+# --- Logging Switches: sample rate for successful requests (errors are always logged) and evidence-text logging ---
+LOG_LEVEL = os.getenv("LLM_LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATE = float(os.getenv("LLM_LOG_SAMPLE_RATE", "0.01"))
+LOG_BODIES = os.getenv("LLM_LOG_BODIES", "0") == "1"
+
+logger = logging.getLogger("llm_dfir")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging():
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+def log_event(event, level=logging.INFO, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+# --- Message text as a log field: the text itself only with LLM_LOG_BODIES=1, otherwise just its length ---
+def text_field(text, name="body"):
+    if text is None:
+        return {}
+    if LOG_BODIES:
+        return {name: text}
+    return {name + "_chars": len(text)}
+
+
+# --- One line per sampled request: endpoint, status, duration, message count, and the body only if enabled ---
+def log_request(method, path, status, seconds, messages=None, body=None):
+    if status < 400 and random.random() >= LOG_SAMPLE_RATE:
+        return
+    fields = {"method": method, "path": path, "status": status, "ms": round(1000 * seconds, 1)}
+    if messages is not None:
+        fields["messages"] = messages
+    if body:
+        fields.update(text_field(body.decode("utf-8", "replace")))
+    log_event("request", logging.WARNING if status >= 500 else logging.INFO, **fields)
+
+
+configure_logging()
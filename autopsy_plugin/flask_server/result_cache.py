@@ -0,0 +1,129 @@
+# --- Imports: sqlite3 for the on-disk store, hashlib for content addressing, threading for the shared connection ---
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+# --- Message Normalisation: identical texts with different whitespace or unicode forms share a cache entry ---
+def normalize_message(message):
+    message = unicodedata.normalize("NFC", message)
+    return " ".join(message.split())
+
+
+def sha256_hex(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# --- Persistent Classification Cache, keyed by hash(normalised message) + model + hash(system prompt) ---
+class ResultCache:
+    """
+    SQLite-backed cache of model replies shared across cases and devices.
+
+    Entries older than max_age_seconds are treated as misses and purged; once the
+    table grows past max_entries the least recently used rows are evicted.
+    """
+
+    def __init__(self, path, max_entries=200000, max_age_seconds=90 * 24 * 3600, evict_every=500):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.evict_every = evict_every
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " reply TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(message, model, system_prompt):
+        return sha256_hex("\x1f".join([sha256_hex(normalize_message(message)), model, sha256_hex(system_prompt)]))
+
+    def get(self, key):
+        return self.get_first([key])
+
+    # --- First fresh reply among several keys (e.g. primary model, then hard-case model), counted as one lookup ---
+    def get_first(self, keys):
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute("SELECT reply, created FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None or now - row[1] > self.max_age_seconds:
+                    continue
+                self._conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    # --- Presence check for offline tools: no hit/miss counting and no last_used refresh ---
+    def contains(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT created FROM results WHERE key = ?", (key,)).fetchone()
+        return row is not None and time.time() - row[0] <= self.max_age_seconds
+
+    def put(self, key, model, reply):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, model, reply, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model, reply, now, now),
+            )
+            self._conn.commit()
+            self.writes += 1
+            due = self.writes % self.evict_every == 0
+        if due:
+            self.evict()
+
+    # --- Eviction: drop expired rows first, then least recently used rows above max_entries ---
+    def evict(self):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM results WHERE created < ?", (time.time() - self.max_age_seconds,))
+            removed = cursor.rowcount
+            overflow = self._count() - self.max_entries
+            if overflow > 0:
+                cursor = self._conn.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+                removed += cursor.rowcount
+            self._conn.commit()
+            self.evictions += removed
+        return removed
+
+    def _count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            entries = self._count()
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "max_age_seconds": self.max_age_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,154 @@
+# --- Imports: shared pooled client for the HTTP calls, threading for outstanding counters and the health checker ---
+import logging
+import threading
+import time
+
+import requests
+from request_log import log_event
+
+
+# --- One Ollama Host: outstanding requests, health state and counters ---
+class Backend:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+
+    def available(self, now):
+        return self.healthy or now >= self.ejected_until
+
+    def snapshot(self):
+        return {
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejections": self.ejections,
+        }
+
+
+# --- Backend Router: least-outstanding-requests routing, ejection of failing hosts and failover to the next one ---
+class BackendRouter:
+    """
+    Every call goes to the available backend with the fewest requests in flight.
+    A connection error, timeout or 5xx counts as a failure; after eject_after
+    consecutive failures the backend is ejected for eject_seconds (or until a
+    health check on /api/tags succeeds) and the call is retried on the next
+    backend, so a host going down mid-ingest does not lose messages.
+    """
+
+    def __init__(self, client, backend_urls, eject_after=2, eject_seconds=30.0, health_path="/api/tags", health_interval=10.0, health_timeout=5.0):
+        self.client = client
+        self.backends = [Backend(url) for url in backend_urls]
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.failovers = 0
+        self._lock = threading.Lock()
+        self._checker = None
+
+    def __len__(self):
+        return len(self.backends)
+
+    def _acquire(self, tried):
+        with self._lock:
+            now = time.monotonic()
+            candidates = [b for b in self.backends if b not in tried and b.available(now)]
+            if not candidates:
+                # every untried backend is ejected: try the one whose ejection ends first rather than fail outright
+                candidates = sorted((b for b in self.backends if b not in tried), key=lambda b: b.ejected_until)[:1]
+            if not candidates:
+                return None
+            backend = min(candidates, key=lambda b: b.outstanding)
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def _release(self, backend, ok):
+        with self._lock:
+            backend.outstanding -= 1
+            if ok:
+                backend.failures = 0
+                backend.healthy = True
+                return
+            backend.errors += 1
+            backend.failures += 1
+            if backend.failures >= self.eject_after:
+                self._eject(backend)
+
+    def _eject(self, backend):
+        if backend.healthy:
+            backend.ejections += 1
+            log_event("backend_ejected", logging.WARNING, backend=backend.base_url)
+        backend.healthy = False
+        backend.ejected_until = time.monotonic() + self.eject_seconds
+
+    # --- POST to `path` on the least loaded backend, failing over until one answers or all have been tried ---
+    def post(self, path, **kwargs):
+        tried = []
+        response = None
+        last_error = None
+        while True:
+            backend = self._acquire(tried)
+            if backend is None:
+                break
+            tried.append(backend)
+            if len(tried) > 1:
+                self.failovers += 1
+            try:
+                response = self.client.post(backend.base_url + path, **kwargs)
+            except requests.RequestException as e:
+                self._release(backend, False)
+                last_error = e
+                log_event("backend_failed", logging.WARNING, backend=backend.base_url, error=type(e).__name__)
+                continue
+            if response.status_code >= 500:
+                self._release(backend, False)
+                last_error = None
+                log_event("backend_failed", logging.WARNING, backend=backend.base_url, status=response.status_code)
+                continue
+            self._release(backend, True)
+            return response
+        if last_error is not None:
+            raise last_error
+        return response
+
+    # --- Background Health Check: ejected backends are re-admitted as soon as /api/tags answers again ---
+    def check_health(self):
+        for backend in self.backends:
+            try:
+                ok = self.client.get(backend.base_url + self.health_path, timeout=self.health_timeout).status_code == 200
+            except requests.RequestException:
+                ok = False
+            with self._lock:
+                if ok:
+                    if not backend.healthy:
+                        log_event("backend_readmitted", backend=backend.base_url)
+                    backend.healthy = True
+                    backend.failures = 0
+                else:
+                    self._eject(backend)
+
+    def start_health_checks(self):
+        if self._checker is not None:
+            return
+
+        def loop():
+            while True:
+                self.check_health()
+                time.sleep(self.health_interval)
+
+        self._checker = threading.Thread(target=loop, name="ollama-health-check", daemon=True)
+        self._checker.start()
+
+    def stats(self):
+        with self._lock:
+            return {"failovers": self.failovers, "backends": [b.snapshot() for b in self.backends]}
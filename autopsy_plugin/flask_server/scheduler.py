@@ -0,0 +1,90 @@
+# --- Imports: threading/queue for the collector loop, futures to hand results back to waiting request threads ---
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import Histogram
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60]
+QUEUE_WAIT_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5]
+
+
+# --- Micro-Batching Scheduler: groups concurrent requests over a short window before calling the model ---
+class MicroBatcher:
+    """
+    Request threads call submit() and block on the returned future. A collector
+    thread takes the first waiting item, keeps collecting until max_batch_size
+    items or max_wait_seconds have passed, and hands the batch to
+    process_batch(items) -> results (same order). At most max_in_flight batches
+    run at once; while all slots are busy new requests queue up, so the next
+    batch is naturally fuller under load.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait_seconds=0.02, max_in_flight=2):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.max_in_flight = max_in_flight
+
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+        self.batch_sizes = Histogram(list(range(1, max_batch_size + 1)))
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queue_wait = Histogram(QUEUE_WAIT_BUCKETS)
+        self.errors = 0
+
+        self._collector = threading.Thread(target=self._run, name="microbatch-collector", daemon=True)
+        self._collector.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def _run(self):
+        while True:
+            self._slots.acquire()
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.batch_sizes.observe(len(batch))
+            dispatched = time.monotonic()
+            for _, _, submitted in batch:
+                self.queue_wait.observe(dispatched - submitted)
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        try:
+            results = self.process_batch([item for item, _, _ in batch])
+            for (_, future, submitted), result in zip(batch, results):
+                self.latency.observe(time.monotonic() - submitted)
+                future.set_result(result)
+        except Exception as e:
+            self.errors += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_seconds": self.max_wait_seconds,
+            "max_in_flight": self.max_in_flight,
+            "errors": self.errors,
+            "batch_size": self.batch_sizes.snapshot(),
+            "latency_seconds": self.latency.snapshot(),
+            "queue_wait_seconds": self.queue_wait.snapshot(),
+        }
@@ -0,0 +1,251 @@
+# --- Imports: Quart (async Flask API) for the ASGI app, asyncio for coalescing and backpressure ---
+import asyncio
+import logging
+import threading
+import time
+
+from quart import Quart, Response, g, request, jsonify
+from classifier import (
+    LLM_PROVIDER,
+    classify_message,
+    classify_thread_window,
+    classifier_stats,
+    get_structured_response,
+    providers,
+    write_prometheus,
+)
+from metrics import RequestMetrics, PrometheusWriter
+from request_log import log_event, log_request
+from result_cache import normalize_message
+
+# Async serving mode for the same endpoints as server.py. Run with an ASGI server, e.g.
+#     hypercorn server_async:app --bind 0.0.0.0:8000
+# Waiting requests are cheap coroutines; only UPSTREAM_CONCURRENCY blocking Ollama calls run at once.
+
+# --- Quart App Initialization ---
+app = Quart(__name__)
+
+# --- Admission Control: messages admitted (queued + running) before new requests get 429 + Retry-After ---
+MAX_PENDING_MESSAGES = 512
+RETRY_AFTER_SECONDS = 5
+
+# --- Upstream Concurrency: blocking classifier calls run in worker threads, at most this many at a time ---
+UPSTREAM_CONCURRENCY = 8
+
+MAX_BATCH_SIZE = 64
+MAX_THREAD_WINDOW = 16  # each message also needs a ~80-100 token JSON object in the reply
+
+
+# --- Single-Flight Group: identical message bodies in flight at the same time share one upstream call ---
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key, make_coroutine):
+        task = self._calls.get(key)
+        if task is None:
+            self.started += 1
+            task = asyncio.ensure_future(make_coroutine())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._calls)
+
+
+# --- Bounded Queue: counts admitted messages and rejects work beyond MAX_PENDING_MESSAGES ---
+class AdmissionQueue:
+    def __init__(self, limit):
+        self.limit = limit
+        self.pending = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_admit(self, count):
+        with self._lock:
+            if self.pending + count > self.limit:
+                self.rejected += 1
+                return False
+            self.pending += count
+            return True
+
+    def release(self, count):
+        with self._lock:
+            self.pending -= count
+
+
+single_flight = SingleFlight()
+admission = AdmissionQueue(MAX_PENDING_MESSAGES)
+request_metrics = RequestMetrics()
+upstream_slots = None
+
+
+def get_upstream_slots():
+    global upstream_slots
+    if upstream_slots is None:
+        upstream_slots = asyncio.Semaphore(UPSTREAM_CONCURRENCY)
+    return upstream_slots
+
+
+async def run_upstream(func, *args):
+    async with get_upstream_slots():
+        return await asyncio.to_thread(func, *args)
+
+
+def too_busy(key):
+    response = jsonify({key: [] if key == 'replies' else 'Server busy, retry later', 'error': 'Too many pending requests'})
+    return response, 429, {'Retry-After': str(RETRY_AFTER_SECONDS)}
+
+
+# --- Per-Request Timing and Structured, Sampled Request Log ---
+@app.before_request
+async def start_timer():
+    g.started = time.perf_counter()
+
+
+@app.after_request
+async def record_request(response):
+    seconds = time.perf_counter() - g.get('started', time.perf_counter())
+    request_metrics.record(request.path, response.status_code, seconds)
+    payload = await request.get_json(silent=True) if request.is_json else None
+    messages = payload.get('messages') if isinstance(payload, dict) else None
+    count = len(messages) if isinstance(messages, list) else (1 if isinstance(payload, dict) and 'message' in payload else None)
+    log_request(request.method, request.path, response.status_code, seconds, count, await request.get_data())
+    return response
+
+
+# --- Coalesced Classification Helpers ---
+async def coalesced_reply(message, provider=None):
+    key = (provider or LLM_PROVIDER, "reply", normalize_message(message))
+    return await single_flight.do(key, lambda: run_upstream(classify_message, message, provider))
+
+
+async def coalesced_structured(message, provider=None):
+    if not message:
+        return None
+    key = (provider or LLM_PROVIDER, "structured", normalize_message(message))
+    return await single_flight.do(key, lambda: run_upstream(get_structured_response, message, provider))
+
+
+def unknown_provider(payload):
+    provider = payload.get('provider')
+    return provider is not None and provider not in providers
+
+
+# --- Every item of a "messages" list must be a string; anything else is rejected before it reaches the classifier ---
+def non_string_messages(messages):
+    return any(not isinstance(message, str) for message in messages)
+
+
+# --- Endpoint to Receive POST Requests with Message and Return Processed Reply ---
+@app.route('/reply', methods=['POST'])
+async def reply():
+    payload = await request.get_json(silent=True)
+    if payload is None:
+        return jsonify({'reply': 'Invalid request format. Please send JSON.'}), 400
+    message = payload.get('message')
+    if not message:
+        return jsonify({'reply': 'No message received'}), 400
+    if unknown_provider(payload):
+        return jsonify({'reply': 'Unknown provider'}), 400
+
+    if not admission.try_admit(1):
+        return too_busy('reply')
+    try:
+        response = await coalesced_reply(message, payload.get('provider'))
+    except Exception as e:
+        log_event("upstream_error", logging.WARNING, error=type(e).__name__, detail=str(e))
+        response = None
+    finally:
+        admission.release(1)
+
+    if response:
+        return jsonify({'reply': response})
+    return jsonify({'reply': 'Error contacting the model provider'}), 500
+
+
+# --- Endpoint to Classify a Batch of Messages; duplicates within and across requests are coalesced ---
+@app.route('/reply_batch', methods=['POST'])
+async def reply_batch():
+    payload = await request.get_json(silent=True)
+    if payload is None:
+        return jsonify({'replies': [], 'error': 'Invalid request format. Please send JSON.'}), 400
+    messages = payload.get('messages')
+    if not isinstance(messages, list) or not messages:
+        return jsonify({'replies': [], 'error': 'No messages received'}), 400
+    if len(messages) > MAX_BATCH_SIZE:
+        return jsonify({'replies': [], 'error': f'Batch too large, max {MAX_BATCH_SIZE} messages'}), 413
+    if non_string_messages(messages):
+        return jsonify({'replies': [], 'error': 'Every message must be a string'}), 400
+    if unknown_provider(payload):
+        return jsonify({'replies': [], 'error': 'Unknown provider'}), 400
+
+    if not admission.try_admit(len(messages)):
+        return too_busy('replies')
+    try:
+        replies = await asyncio.gather(*[coalesced_structured(message, payload.get('provider')) for message in messages])
+    finally:
+        admission.release(len(messages))
+    return jsonify({'replies': list(replies)})
+
+
+# --- Endpoint to Classify a Conversation Window in a Single Prompt ---
+@app.route('/reply_thread', methods=['POST'])
+async def reply_thread():
+    payload = await request.get_json(silent=True)
+    if payload is None:
+        return jsonify({'replies': [], 'error': 'Invalid request format. Please send JSON.'}), 400
+    messages = payload.get('messages')
+    if not isinstance(messages, list) or not messages:
+        return jsonify({'replies': [], 'error': 'No messages received'}), 400
+    if len(messages) > MAX_THREAD_WINDOW:
+        return jsonify({'replies': [], 'error': f'Window too large, max {MAX_THREAD_WINDOW} messages'}), 413
+    if non_string_messages(messages):
+        return jsonify({'replies': [], 'error': 'Every message must be a string'}), 400
+    if unknown_provider(payload):
+        return jsonify({'replies': [], 'error': 'Unknown provider'}), 400
+
+    if not admission.try_admit(len(messages)):
+        return too_busy('replies')
+    try:
+        replies = await run_upstream(classify_thread_window, messages, payload.get('provider'))
+    finally:
+        admission.release(len(messages))
+    return jsonify({'replies': replies})
+
+
+# --- Endpoint to Report Classifier Statistics plus Queue Depth and Coalescing Counters ---
+@app.route('/stats', methods=['GET'])
+async def stats():
+    data = classifier_stats()
+    data['async'] = {
+        'pending_messages': admission.pending,
+        'max_pending_messages': admission.limit,
+        'rejected_requests': admission.rejected,
+        'upstream_in_flight': len(single_flight),
+        'upstream_calls': single_flight.started,
+        'coalesced_calls': single_flight.coalesced,
+    }
+    return jsonify(data)
+
+
+# --- Endpoint to Expose Prometheus Series, including admission queue depth and coalescing counters ---
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    writer = PrometheusWriter()
+    request_metrics.write_prometheus(writer)
+    write_prometheus(writer)
+    writer.gauge("admission_pending_messages", "Messages admitted and not yet answered", admission.pending)
+    writer.counter("admission_rejected_total", "Requests answered with 429", admission.rejected)
+    writer.counter("coalesced_calls_total", "Requests that joined an identical in-flight upstream call", single_flight.coalesced)
+    return Response(writer.text(), mimetype='text/plain; version=0.0.4')
+
+
+# --- Run Quart App (development server; use hypercorn/uvicorn in production) ---
+if __name__ == '__main__':
+    app.run(port=8000)
@@ -0,0 +1,188 @@
+# --- Stub Ollama Backend: answers /api/generate and /api/tags locally so routing and failover can be tested without a GPU ---
+# Also mocks the OpenAI Batch API (/v1/files, /v1/batches) for batch_job.py; batches complete after --batch-seconds.
+# Usage: python stub_backend.py --port 11435 --latency 0.2 --parallel 4
+#        OLLAMA_BACKENDS=http://127.0.0.1:11435,http://127.0.0.1:11436 python server.py
+#        OPENAI_API_URL=http://127.0.0.1:11435/v1/chat/completions python batch_job.py run --input mmssms.db --job t.json
+import argparse
+import email
+import email.policy
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from providers import stub_result
+
+
+# --- Malformed Replies for exercising the repair layer: a near miss (fenced, trailing comma) or a broken one ---
+def malformed_reply(reply):
+    if random.random() < 0.5:
+        return "```json\n" + reply[:-1] + ",}\n```"
+    return "Sorry, I cannot help with that."
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if self.path == "/api/tags":
+            self.send_json(200, {"models": [{"name": self.server.model}]})
+        elif parts[:2] == ["v1", "batches"] and len(parts) == 3 and parts[2] in self.server.batches:
+            self.send_json(200, self.server.batch_status(parts[2]))
+        elif parts[:2] == ["v1", "files"] and parts[3:] == ["content"] and parts[2] in self.server.files:
+            self.send_bytes(200, "application/jsonl", self.server.files[parts[2]])
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/v1/files":
+            self.send_json(200, self.server.upload(self.headers.get("Content-Type", ""), body))
+            return
+        if self.path == "/v1/batches":
+            data = json.loads(body or b"{}")
+            if data.get("input_file_id") not in self.server.files:
+                self.send_json(404, {"error": {"message": "No such file"}})
+                return
+            self.send_json(200, self.server.create_batch(data["input_file_id"]))
+            return
+        if self.path != "/api/generate":
+            self.send_json(404, {"error": "not found"})
+            return
+        if random.random() < self.server.fail_rate:
+            self.send_json(500, {"error": "stub failure"})
+            return
+
+        data = json.loads(body or b"{}")
+        # a semaphore stands in for Ollama's OLLAMA_NUM_PARALLEL slots; extra requests wait for a free slot
+        with self.server.slots:
+            started = time.monotonic()
+            time.sleep(self.server.latency)
+            elapsed = int((time.monotonic() - started) * 1e9)
+        self.server.count()
+        prompt = data.get("prompt", "")
+        reply = json.dumps(stub_result(prompt))
+        if random.random() < self.server.bad_json_rate:
+            reply = malformed_reply(reply)
+        self.send_json(200, {
+            "model": data.get("model", self.server.model),
+            "response": reply,
+            "done": True,
+            "prompt_eval_count": len(prompt.split()),
+            "prompt_eval_duration": elapsed // 4,
+            "eval_count": 60,
+            "eval_duration": elapsed - elapsed // 4,
+            "total_duration": elapsed,
+        })
+
+    def send_json(self, status, payload):
+        self.send_bytes(status, "application/json", json.dumps(payload).encode("utf-8"))
+
+    def send_bytes(self, status, content_type, encoded):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency, parallel, fail_rate, model, bad_json_rate=0.0, batch_seconds=2.0):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.slots = threading.Semaphore(parallel)
+        self.fail_rate = fail_rate
+        self.bad_json_rate = bad_json_rate
+        self.model = model
+        self.batch_seconds = batch_seconds
+        self.requests = 0
+        self.files = {}
+        self.batches = {}
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+    # --- Batch API Mock: multipart upload stored in memory; a batch turns "completed" batch_seconds after creation ---
+    def upload(self, content_type, body):
+        form = email.message_from_bytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body,
+                                        policy=email.policy.HTTP)
+        content = next(part.get_payload(decode=True) for part in form.iter_parts() if part.get_filename())
+        file_id = "file-" + uuid.uuid4().hex[:12]
+        with self._lock:
+            self.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "purpose": "batch"}
+
+    def create_batch(self, input_file_id):
+        batch_id = "batch_" + uuid.uuid4().hex[:12]
+        with self._lock:
+            self.batches[batch_id] = {"input_file_id": input_file_id, "created": time.time(), "output_file_id": None}
+        return self.batch_status(batch_id)
+
+    def batch_status(self, batch_id):
+        batch = self.batches[batch_id]
+        lines = self.files[batch["input_file_id"]].decode("utf-8").splitlines()
+        done = time.time() - batch["created"] >= self.batch_seconds
+        if done and batch["output_file_id"] is None:
+            output = "".join(json.dumps(self.batch_reply(json.loads(line))) + "\n" for line in lines if line.strip())
+            file_id = "file-" + uuid.uuid4().hex[:12]
+            with self._lock:
+                self.files[file_id] = output.encode("utf-8")
+                batch["output_file_id"] = file_id
+        return {
+            "id": batch_id,
+            "object": "batch",
+            "status": "completed" if done else "in_progress",
+            "input_file_id": batch["input_file_id"],
+            "output_file_id": batch["output_file_id"],
+            "error_file_id": None,
+            "request_counts": {"total": len(lines), "completed": len(lines) if done else 0, "failed": 0},
+        }
+
+    def batch_reply(self, request):
+        self.count()
+        prompt = request["body"]["messages"][-1]["content"]
+        if random.random() < self.fail_rate:
+            return {"custom_id": request["custom_id"], "response": {"status_code": 500, "body": {}}, "error": None}
+        reply = json.dumps(stub_result(prompt))
+        if random.random() < self.bad_json_rate:
+            reply = malformed_reply(reply)
+        return {"custom_id": request["custom_id"], "error": None, "response": {"status_code": 200, "body": {
+            "model": request["body"].get("model", self.model),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": 60},
+        }}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the Ollama API for load and failover tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per generate call")
+    parser.add_argument("--parallel", type=int, default=4, help="concurrent generate calls, like OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of generate calls answered with 500")
+    parser.add_argument("--bad-json-rate", type=float, default=0.0, help="fraction of replies that are malformed JSON")
+    parser.add_argument("--model", default="gemma2:9b")
+    parser.add_argument("--batch-seconds", type=float, default=2.0, help="seconds before a mock Batch API job completes")
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), args.latency, args.parallel, args.fail_rate, args.model,
+                        args.bad_json_rate, args.batch_seconds)
+    print(f"Stub Ollama backend on http://{args.host}:{args.port} (latency {args.latency}s, {args.parallel} slots)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
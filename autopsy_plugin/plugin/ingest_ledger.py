@@ -0,0 +1,106 @@
+# --- Ingest ledger: remembers which mmssms.db rows were already classified so re-runs only send new or changed rows ---
+
+import hashlib
+import json
+from java.lang import Class
+from java.sql import DriverManager
+
+
+# --- Row fingerprint stored next to every classified sms._id ---
+def body_hash(body):
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+# --- SQLite ledger kept in the case's module output folder (one per case) ---
+class IngestLedger(object):
+    """
+    Tables:
+      watermark  - one row per mmssms.db file ID: max sms._id, row count and a
+                   content hash of (_id, body) from the last completed run.
+      classified - one row per posted artifact: file ID, sms._id, body hash and
+                   the classification result, so unchanged bodies seen in a new
+                   acquisition can be re-posted without another LLM call.
+    """
+
+    def __init__(self, path):
+        Class.forName("org.sqlite.JDBC").newInstance()
+        self.conn = DriverManager.getConnection("jdbc:sqlite:%s" % path)
+        stmt = self.conn.createStatement()
+        stmt.executeUpdate("CREATE TABLE IF NOT EXISTS watermark ("
+                           " file_id INTEGER PRIMARY KEY, max_id INTEGER, row_count INTEGER, content_hash TEXT)")
+        stmt.executeUpdate("CREATE TABLE IF NOT EXISTS classified ("
+                           " file_id INTEGER, row_key TEXT, body_hash TEXT, result TEXT,"
+                           " PRIMARY KEY (file_id, row_key))")
+        stmt.executeUpdate("CREATE INDEX IF NOT EXISTS classified_body_hash ON classified (body_hash)")
+        stmt.close()
+        self.conn.setAutoCommit(False)
+        self._insert = self.conn.prepareStatement(
+            "INSERT OR REPLACE INTO classified (file_id, row_key, body_hash, result) VALUES (?, ?, ?, ?)")
+        self._lookup = self.conn.prepareStatement("SELECT result FROM classified WHERE body_hash = ? LIMIT 1")
+        self._pending = 0
+
+    def get_watermark(self, file_id):
+        stmt = self.conn.prepareStatement("SELECT max_id, row_count, content_hash FROM watermark WHERE file_id = ?")
+        stmt.setLong(1, file_id)
+        rs = stmt.executeQuery()
+        watermark = None
+        if rs.next():
+            watermark = {"max_id": rs.getLong(1), "row_count": rs.getLong(2), "content_hash": rs.getString(3)}
+        rs.close()
+        stmt.close()
+        return watermark
+
+    def set_watermark(self, file_id, max_id, row_count, content_hash):
+        stmt = self.conn.prepareStatement(
+            "INSERT OR REPLACE INTO watermark (file_id, max_id, row_count, content_hash) VALUES (?, ?, ?, ?)")
+        stmt.setLong(1, file_id)
+        stmt.setLong(2, max_id)
+        stmt.setLong(3, row_count)
+        stmt.setString(4, content_hash)
+        stmt.executeUpdate()
+        stmt.close()
+        self.commit()
+
+    # --- {row_key: body_hash} for every row of this file that already has an artifact ---
+    def classified_hashes(self, file_id):
+        stmt = self.conn.prepareStatement("SELECT row_key, body_hash FROM classified WHERE file_id = ?")
+        stmt.setLong(1, file_id)
+        rs = stmt.executeQuery()
+        hashes = {}
+        while rs.next():
+            hashes[rs.getString(1)] = rs.getString(2)
+        rs.close()
+        stmt.close()
+        return hashes
+
+    # --- Result previously stored for an identical body in any file of this case, or None ---
+    def find_result(self, hash_value):
+        self._lookup.setString(1, hash_value)
+        rs = self._lookup.executeQuery()
+        result = None
+        if rs.next():
+            result = json.loads(rs.getString(1))
+        rs.close()
+        return result
+
+    def record(self, file_id, row_key, hash_value, result):
+        self._insert.setLong(1, file_id)
+        self._insert.setString(2, row_key)
+        self._insert.setString(3, hash_value)
+        self._insert.setString(4, json.dumps(result))
+        self._insert.addBatch()
+        self._pending += 1
+        if self._pending >= 500:
+            self.commit()
+
+    def commit(self):
+        if self._pending:
+            self._insert.executeBatch()
+            self._pending = 0
+        self.conn.commit()
+
+    def close(self):
+        self.commit()
+        self._insert.close()
+        self._lookup.close()
+        self.conn.close()
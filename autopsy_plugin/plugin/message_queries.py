@@ -0,0 +1,26 @@
+# --- Message queries shared by the ingest module (sms.py), bulk_classify.py and batch_job.py, so every tool sends the same
+#     text per message (MMS text parts joined per pdu) and the server's cache keys line up between them ---
+# Plain strings only, so it loads under Autopsy's Jython 2.7 as well as CPython.
+
+# --- One date-ordered pass over SMS (and MMS text parts) with the columns needed for threading ---
+SMS_QUERY = (
+    "SELECT 'sms' AS source, _id, thread_id, address, date, type, body FROM sms"
+    " WHERE body IS NOT NULL AND body != ''"
+)
+MMS_QUERY = (
+    "SELECT 'mms' AS source, pdu._id AS _id, pdu.thread_id AS thread_id,"
+    " (SELECT addr.address FROM addr WHERE addr.msg_id = pdu._id AND addr.type = 137 LIMIT 1) AS address,"
+    " pdu.date * 1000 AS date, pdu.msg_box AS type, group_concat(part.text, ' ') AS body"
+    " FROM pdu JOIN part ON part.mid = pdu._id"
+    " WHERE part.ct = 'text/plain' AND part.text IS NOT NULL AND part.text != ''"
+    " GROUP BY pdu._id"
+)
+MMS_TABLES = ("pdu", "part", "addr")
+
+
+# --- Full message query for a database with the given table names; MMS text only when its tables exist ---
+def message_query(tables, include_mms=True):
+    query = SMS_QUERY
+    if include_mms and set(MMS_TABLES).issubset(tables):
+        query += " UNION ALL " + MMS_QUERY
+    return query + " ORDER BY date"
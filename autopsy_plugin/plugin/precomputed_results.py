@@ -0,0 +1,78 @@
+# --- Precomputed results: classifications produced outside Autopsy (bulk_classify.py or any JSONL export), looked up by
+#     the mmssms.db file hash and "sms:<_id>" / "mms:<_id>" so the ingest module can create artifacts without the LLM ---
+
+import json
+from java.lang import Class
+from java.sql import DriverManager
+
+
+def row_key_of(item):
+    if item.get("row_key"):
+        return item["row_key"]
+    return "%s:%d" % (item.get("source") or "sms", int(item["_id"]))
+
+
+# --- Sidecar reader for a bulk_classify.py SQLite store or a JSONL file ---
+class PrecomputedResults(object):
+    """
+    SQLite: the bulk_classify.py store (results keyed by db_sha256 + row_key,
+            sources mapping db_sha256 to db_md5).
+    JSONL:  one object per line with "file_hash" (or "db_sha256" / "db_md5"),
+            "row_key" (or "_id" plus optional "source") and "result".
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.is_sqlite = not path.lower().endswith(".jsonl")
+
+    # --- Returns {row_key: result dict} for the first of the given hashes (sha256, md5) that the sidecar knows ---
+    def results_for(self, hashes):
+        hashes = [h.lower() for h in hashes if h]
+        if not hashes:
+            return {}
+        if self.is_sqlite:
+            return self._sqlite_results(hashes)
+        return self._jsonl_results(hashes)
+
+    def _sqlite_results(self, hashes):
+        Class.forName("org.sqlite.JDBC").newInstance()
+        conn = DriverManager.getConnection("jdbc:sqlite:%s" % self.path)
+        try:
+            find_source = conn.prepareStatement("SELECT db_sha256 FROM sources WHERE db_sha256 = ? OR db_md5 = ? LIMIT 1")
+            select = conn.prepareStatement("SELECT row_key, result FROM results WHERE db_sha256 = ?")
+            for file_hash in hashes:
+                find_source.setString(1, file_hash)
+                find_source.setString(2, file_hash)
+                rs = find_source.executeQuery()
+                db_sha256 = rs.getString(1) if rs.next() else None
+                rs.close()
+                if db_sha256 is None:
+                    continue
+                select.setString(1, db_sha256)
+                rs = select.executeQuery()
+                results = {}
+                while rs.next():
+                    results[rs.getString(1)] = json.loads(rs.getString(2))
+                rs.close()
+                return results
+            return {}
+        finally:
+            conn.close()
+
+    def _jsonl_results(self, hashes):
+        by_hash = dict((h, {}) for h in hashes)
+        f = open(self.path, "r")
+        try:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                file_hash = (item.get("file_hash") or item.get("db_sha256") or item.get("db_md5") or "").lower()
+                if file_hash in by_hash and isinstance(item.get("result"), dict):
+                    by_hash[file_hash][row_key_of(item)] = item["result"]
+        finally:
+            f.close()
+        for file_hash in hashes:
+            if by_hash[file_hash]:
+                return by_hash[file_hash]
+        return {}
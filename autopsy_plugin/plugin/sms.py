@@ -8,6 +8,8 @@ from java.lang import System
 from java.sql  import DriverManager, SQLException
 from java.util.logging import Level
 from java.util import Arrays
+from java.util import ArrayList
+from org.sqlite import SQLiteConfig
 from java.io import File
 from org.sleuthkit.datamodel import SleuthkitCase
 from org.sleuthkit.datamodel import AbstractFile
@@ -30,7 +32,84 @@ from org.sleuthkit.autopsy.casemodule.services import Blackboard
 
 from java.net import URL, HttpURLConnection
 from java.io import OutputStreamWriter, BufferedReader, InputStreamReader
+from java.security import MessageDigest
 import json
+import hashlib
+import threading
+import time
+from Queue import Queue, Empty, Full
+from sms_dedupe import SmsClusterIndex, ClusterResults
+from ingest_ledger import IngestLedger, body_hash
+from precomputed_results import PrecomputedResults
+from message_queries import message_query
+
+
+# --- Classification server settings: base URL of the Flask API and number of SMS sent per /reply_batch call ---
+LLM_API_URL = "http://localhost:8000"
+LLM_BATCH_SIZE = 16
+LLM_BUSY_RETRIES = 5
+
+# --- Ingest pipeline settings: concurrent /reply_batch requests in flight and chunks buffered between reader and workers ---
+LLM_WORKERS = 4
+LLM_QUEUE_CHUNKS = 8
+
+# --- Classification mode: "message" sends independent chunks to /reply_batch; "thread" sends token-bounded
+#     windows of one conversation (thread_id, else address) to /reply_thread so short replies get context ---
+# The window budget counts each message's text plus its 17-key JSON object in the reply, and together with the
+# ~710-token system prompt must fit the server's OLLAMA_NUM_CTX (4096), or the reply is cut off mid-JSON.
+CLASSIFICATION_MODE = "message"
+THREAD_WINDOW_TOKENS = 2800
+THREAD_WINDOW_MAX_MESSAGES = 12
+THREAD_REPLY_TOKENS_PER_MESSAGE = 100
+
+# --- Duplicate collapsing: only one representative per exact/near-duplicate cluster is sent to the LLM ---
+DEDUPE_ENABLED = True
+DEDUPE_NEAR_THRESHOLD = 0.8
+
+# --- Message source settings: rows fetched per JDBC round-trip, MMS text parts, and reading local DBs in place ---
+SMS_FETCH_SIZE = 500
+INCLUDE_MMS_TEXT = True
+READ_LOCAL_DB_IN_PLACE = True
+
+# --- sms.type / pdu.msg_box values mapped to TSK_DIRECTION ---
+MESSAGE_DIRECTIONS = {1: "Incoming", 2: "Outgoing"}
+
+# --- Incremental re-ingest: rows already classified for the same file ID (same body hash) are not sent again ---
+INCREMENTAL_INGEST = True
+
+# --- Precomputed results: a sidecar (bulk_classify.py SQLite store or JSONL) keyed by mmssms.db SHA-256/MD5 + "sms:<_id>" ---
+# With PRECOMPUTED_ONLY the server is never called and rows missing from the sidecar get no artifact;
+# otherwise those rows are classified by the server as usual.
+PRECOMPUTED_RESULTS_PATH = None  # e.g. r"C:\Cases\case42\bulk_results.db"
+PRECOMPUTED_ONLY = True
+
+# --- Artifacts are created with all attributes at once and posted to the blackboard in batches of this size ---
+ARTIFACT_POST_BATCH = 200
+
+# --- TSK_CUSTOM_SMS attributes: (attribute type name, display name, key in the LLM reply or None for the SMS text) ---
+SMS_ATTRIBUTES = [
+    ("TSK_SMS_TEXT", "SMS Text", None),
+    ("TSK_TAGS", "Tags", "TAGS"),
+    ("TSK_PERSON", "Person", "PERSON"),
+    ("TSK_ORGANIZATION", "Organization", "ORG"),
+    ("TSK_GPE", "Geo-Political Entity", "GPE"),
+    ("TSK_NORP", "Nationalities/Religious/Political Groups", "NORP"),
+    ("TSK_DATE", "Date", "DATE"),
+    ("TSK_TIME", "Time", "TIME"),
+    ("TSK_MONEY", "Money", "MONEY"),
+    ("TSK_PERCENT", "Percent", "PERCENT"),
+    ("TSK_FAC", "Facility", "FAC"),
+    ("TSK_PRODUCT", "Product", "PRODUCT"),
+    ("TSK_WORK_OF_ART", "Work of Art", "WORK_OF_ART"),
+    ("TSK_LANGUAGE", "Language", "LANGUAGE"),
+    ("TSK_EVENT", "Event", "EVENT"),
+    ("TSK_LAW", "Law", "LAW"),
+    ("TSK_ORDINAL", "Ordinal", "ORDINAL"),
+    ("TSK_CARDINAL", "Cardinal", "CARDINAL"),
+]
+
+# --- Marker placed on a queue when its producer has nothing more to send ---
+_END_OF_STREAM = object()
 
 
 # --- Factory class that Autopsy uses to recognize and instantiate the ingest module ---
@@ -65,44 +144,60 @@ class smsDbIngestModule(DataSourceIngestModule):
 
     def __init__(self):
         self.context = None
+        self.attribute_types = []
 
 
-    # --- Sends SMS text to local Flask API (LLM) and parses the response ---
-    def process_with_llama_api(self,sms_text):
-       try:
-            url = URL("http://localhost:8000/reply")
-            conn = url.openConnection()
-            conn.setRequestMethod("POST")
-            conn.setRequestProperty("Content-Type", "application/json")
-            conn.setDoOutput(True)
-
-            data = json.dumps({"message": sms_text})
-
-            writer = OutputStreamWriter(conn.getOutputStream())
-            writer.write(data)
-            writer.flush()
-            writer.close()
-
-            response_code = conn.getResponseCode()
-            if response_code == HttpURLConnection.HTTP_OK:  # 200
-                reader = BufferedReader(InputStreamReader(conn.getInputStream()))
-                response = ""
-                line = reader.readLine()
-                while line is not None:
-                    response += line
+    # --- Posts a JSON payload to the local Flask API and returns the decoded JSON reply (None on failure) ---
+    # A 429 from the async server is retried after its Retry-After delay, up to LLM_BUSY_RETRIES times.
+    def post_to_llm_api(self, path, payload):
+        data = json.dumps(payload)
+        for attempt in range(LLM_BUSY_RETRIES + 1):
+            try:
+                url = URL(LLM_API_URL + path)
+                conn = url.openConnection()
+                conn.setRequestMethod("POST")
+                conn.setRequestProperty("Content-Type", "application/json")
+                conn.setDoOutput(True)
+
+                writer = OutputStreamWriter(conn.getOutputStream(), "UTF-8")
+                writer.write(data)
+                writer.flush()
+                writer.close()
+
+                response_code = conn.getResponseCode()
+                if response_code == HttpURLConnection.HTTP_OK:  # 200
+                    reader = BufferedReader(InputStreamReader(conn.getInputStream(), "UTF-8"))
+                    response = ""
                     line = reader.readLine()
-                reader.close()
-
-                self.log(Level.INFO, "RESPONSE")
-                self.log(Level.INFO, response)
-                result = json.loads(response)
-                return result.get("reply")
-            else:
-                print("Error calling LLAMA API:", response_code)
-                return "ERROR"
-       except Exception as e:
-            print("Error calling LLAMA API:", str(e))
-            return "ERROR"
+                    while line is not None:
+                        response += line
+                        line = reader.readLine()
+                    reader.close()
+
+                    self.log(Level.INFO, "RESPONSE")
+                    self.log(Level.INFO, response)
+                    return json.loads(response)
+                elif response_code == 429 and attempt < LLM_BUSY_RETRIES:
+                    retry_after = conn.getHeaderField("Retry-After")
+                    time.sleep(float(retry_after) if retry_after else 1.0)
+                else:
+                    print("Error calling LLAMA API:", response_code)
+                    return None
+            except Exception as e:
+                print("Error calling LLAMA API:", str(e))
+                return None
+        return None
+
+    # --- Sends a chunk of SMS texts in one request (/reply_batch or /reply_thread); returns one parsed result (or None) per text ---
+    def process_with_llama_api_batch(self, sms_texts, path="/reply_batch"):
+        result = self.post_to_llm_api(path, {"messages": sms_texts})
+        if result is None:
+            return [None] * len(sms_texts)
+        replies = result.get("replies") or []
+        if len(replies) != len(sms_texts):
+            self.log(Level.WARNING, "Batch reply size mismatch: sent %d, received %d" % (len(sms_texts), len(replies)))
+            return [None] * len(sms_texts)
+        return replies
 
 
     # --- Called before processing begins, stores the context ---
@@ -112,7 +207,8 @@ class smsDbIngestModule(DataSourceIngestModule):
     # --- Creates custom artifact and attribute types for SMS analysis results ---
     def create_custom_artifact_types(self):
         """
-        Create custom artifact and attribute types if they don't exist.
+        Create custom artifact and attribute types if they don't exist, and keep
+        the resolved attribute types in self.attribute_types.
         """
         try:
             blackboard = Case.getCurrentCase().getSleuthkitCase().getBlackboard()
@@ -120,47 +216,376 @@ class smsDbIngestModule(DataSourceIngestModule):
             sms_artifact_type = blackboard.getOrAddArtifactType(
                 "TSK_CUSTOM_SMS", "LLM DFIR PLUGIN")
 
-            blackboard.getOrAddAttributeType(
-                "TSK_SMS_TEXT", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "SMS Text")
-            blackboard.getOrAddAttributeType(
-                "TSK_TAGS", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Tags")
-            blackboard.getOrAddAttributeType(
-                "TSK_PERSON", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Person")
-            blackboard.getOrAddAttributeType(
-                "TSK_ORGANIZATION", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Organization")
-            blackboard.getOrAddAttributeType(
-                "TSK_GPE", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Geo-Political Entity")
-            blackboard.getOrAddAttributeType(
-                "TSK_NORP", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Nationalities/Religious/Political Groups")
-            blackboard.getOrAddAttributeType(
-                "TSK_DATE", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Date")
-            blackboard.getOrAddAttributeType(
-                "TSK_TIME", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Time")
-            blackboard.getOrAddAttributeType(
-                "TSK_MONEY", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Money")
-            blackboard.getOrAddAttributeType(
-                "TSK_PERCENT", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Percent")
-            blackboard.getOrAddAttributeType(
-                "TSK_FAC", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Facility")
-            blackboard.getOrAddAttributeType(
-                "TSK_PRODUCT", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Product")
-            blackboard.getOrAddAttributeType(
-                "TSK_WORK_OF_ART", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Work of Art")
-            blackboard.getOrAddAttributeType(
-                "TSK_LANGUAGE", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Language")
-            blackboard.getOrAddAttributeType(
-                "TSK_EVENT", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Event")
-            blackboard.getOrAddAttributeType(
-                "TSK_LAW", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Law")
-            blackboard.getOrAddAttributeType(
-                "TSK_ORDINAL", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Ordinal")
-            blackboard.getOrAddAttributeType(
-                "TSK_CARDINAL", BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, "Cardinal")
+            # Resolved once per ingest job and reused for every artifact
+            self.attribute_types = []
+            for type_name, display_name, reply_key in SMS_ATTRIBUTES:
+                attribute_type = blackboard.getOrAddAttributeType(
+                    type_name, BlackboardAttribute.TSK_BLACKBOARD_ATTRIBUTE_VALUE_TYPE.STRING, display_name)
+                self.attribute_types.append((attribute_type, reply_key))
 
             return sms_artifact_type
         except Exception as e:
             Logger.getLogger(smsDbIngestModuleFactory.moduleName).log(Level.SEVERE, "Error creating custom artifact types: " + str(e))
 
+    # --- Puts an item on a bounded queue, giving up if the pipeline is stopped while waiting for space ---
+    def put_unless_stopped(self, queue, item, stop):
+        while not stop.is_set():
+            try:
+                queue.put(item, True, 0.5)
+                return True
+            except Full:
+                pass
+        return False
+
+    # --- Incremental pre-pass: hashes the sms table and decides which rows still need an artifact ---
+    def plan_incremental_run(self, stmt, query, file_id, ledger):
+        rows = []
+        digest = hashlib.sha1()
+        max_id = 0
+        rs = stmt.executeQuery(query)
+        while rs.next():
+            row = self.read_message_row(rs)
+            if row is None:
+                continue
+            digest.update((row["key"] + row["hash"]).encode("utf-8"))
+            rows.append((row["key"], row["id"], row["hash"]))
+            if row["source"] == "sms":
+                max_id = max(max_id, row["id"])
+        rs.close()
+
+        plan = {"skip": set(), "reuse": {}, "max_id": max_id, "row_count": len(rows), "content_hash": digest.hexdigest()}
+        watermark = ledger.get_watermark(file_id)
+        if watermark is not None and watermark["content_hash"] == plan["content_hash"]:
+            plan["skip"] = set(key for key, _, _ in rows)
+            return plan
+
+        known = ledger.classified_hashes(file_id)
+        for key, _, hash_value in rows:
+            if known.get(key) == hash_value:
+                plan["skip"].add(key)
+                continue
+            result = ledger.find_result(hash_value)
+            if result is not None:
+                plan["reuse"][key] = result
+
+        if watermark is not None:
+            self.log(Level.INFO, "%d rows above previous watermark _id %d" % (
+                len([key for key, sms_id, _ in rows if key.startswith("sms:") and sms_id > watermark["max_id"]]),
+                watermark["max_id"]))
+        return plan
+
+    # --- SHA-256 of the file content, read through Autopsy, for looking up precomputed results ---
+    def file_sha256(self, file):
+        digest = MessageDigest.getInstance("SHA-256")
+        stream = ReadContentInputStream(file)
+        buf = jarray.zeros(1 << 20, "b")
+        try:
+            count = stream.read(buf)
+            while count > 0:
+                digest.update(buf, 0, count)
+                count = stream.read(buf)
+        finally:
+            stream.close()
+        return "".join("%02x" % (b & 0xff) for b in digest.digest())
+
+    # --- Precomputed results for one mmssms.db, matched on SHA-256 first and then Autopsy's MD5 (None if there are none) ---
+    def load_precomputed(self, sidecar, file):
+        try:
+            results = sidecar.results_for([self.file_sha256(file), file.getMd5Hash()])
+        except Exception as e:
+            self.log(Level.WARNING, "Could not read precomputed results from %s: %s" % (sidecar.path, str(e)))
+            return None
+        self.log(Level.INFO, "%s: %d precomputed results in %s" % (file.getName(), len(results), sidecar.path))
+        return results or None
+
+    # --- Builds the message query for one database, adding MMS text only when the pdu/part tables exist ---
+    def build_message_query(self, dbConn):
+        tables = set()
+        if INCLUDE_MMS_TEXT:
+            rs = dbConn.getMetaData().getTables(None, None, "%", None)
+            while rs.next():
+                tables.add(rs.getString("TABLE_NAME"))
+            rs.close()
+        return message_query(tables, INCLUDE_MMS_TEXT)
+
+    # --- Converts the current result set row into the dict passed through the pipeline (None if it has no text) ---
+    def read_message_row(self, resultSet):
+        try:
+            body = resultSet.getString("body")
+            if not body:
+                return None
+            source = resultSet.getString("source")
+            message_id = resultSet.getLong("_id")
+            return {
+                "key": "%s:%d" % (source, message_id),
+                "source": source,
+                "id": message_id,
+                "thread_id": resultSet.getObject("thread_id"),
+                "address": resultSet.getString("address"),
+                "date": resultSet.getObject("date"),
+                "type": resultSet.getObject("type"),
+                "body": body,
+                "hash": body_hash(body),
+            }
+        except SQLException:
+            return None
+
+    # --- Conversation a row belongs to in thread mode, or None to classify it on its own ---
+    def conversation_key(self, row):
+        if row.get("thread_id") is not None:
+            return "thread:%s" % row["thread_id"]
+        if row.get("address"):
+            return "address:%s" % row["address"]
+        return None
+
+    # --- Rough window cost of one message: its text (about 4 characters per token plus numbering) and its reply object ---
+    def estimate_tokens(self, body):
+        return len(body) // 4 + 8 + THREAD_REPLY_TOKENS_PER_MESSAGE
+
+    # --- Reader stage: streams message rows from the result set and queues work chunks of (endpoint, [(cluster_id, row)]) ---
+    # Message mode queues cluster representatives in chunks of LLM_BATCH_SIZE; thread mode queues conversation windows.
+    def read_sms_rows(self, resultSet, plan, chunk_queue, result_queue, clusters, stop):
+        try:
+            index = SmsClusterIndex(DEDUPE_NEAR_THRESHOLD) if clusters is not None else None
+            pending = []
+            windows = {}
+            while not stop.is_set() and resultSet.next():
+                row = self.read_message_row(resultSet)
+                if row is None:
+                    continue
+                body = row["body"]
+
+                if plan is not None:
+                    if row["key"] in plan["skip"]:
+                        continue
+                    if row["key"] in plan["reuse"]:
+                        result_queue.put((row, plan["reuse"][row["key"]]))
+                        continue
+
+                conversation = self.conversation_key(row) if CLASSIFICATION_MODE == "thread" else None
+                if conversation is not None:
+                    window = windows.setdefault(conversation, {"items": [], "tokens": 0})
+                    tokens = self.estimate_tokens(body)
+                    if window["items"] and (window["tokens"] + tokens > THREAD_WINDOW_TOKENS
+                                            or len(window["items"]) >= THREAD_WINDOW_MAX_MESSAGES):
+                        if not self.put_unless_stopped(chunk_queue, ("/reply_thread", window["items"]), stop):
+                            return
+                        window["items"], window["tokens"] = [], 0
+                    window["items"].append((None, row))
+                    window["tokens"] += tokens
+                    continue
+
+                cluster_id = None
+                if index is not None:
+                    cluster_id, is_new = index.assign(body)
+                    if not is_new:
+                        for item in clusters.add_member(cluster_id, row):
+                            result_queue.put(item)
+                        continue
+                    clusters.add_representative(cluster_id, row)
+
+                pending.append((cluster_id, row))
+                if len(pending) >= LLM_BATCH_SIZE:
+                    if not self.put_unless_stopped(chunk_queue, ("/reply_batch", pending), stop):
+                        return
+                    pending = []
+
+            if pending:
+                self.put_unless_stopped(chunk_queue, ("/reply_batch", pending), stop)
+            for window in windows.values():
+                if window["items"] and not self.put_unless_stopped(chunk_queue, ("/reply_thread", window["items"]), stop):
+                    return
+            if index is not None:
+                self.log(Level.INFO, "Collapsed %d messages into %d clusters (%d exact, %d near duplicates, %d near matches"
+                         " classified on their own)" % (index.messages, len(index), index.exact_hits, index.near_hits,
+                                                        index.near_rejected))
+        except Exception as e:
+            self.log(Level.SEVERE, "Error reading SMS rows: " + str(e))
+        finally:
+            for _ in range(LLM_WORKERS):
+                self.put_unless_stopped(chunk_queue, _END_OF_STREAM, stop)
+
+    # --- Worker stage: classifies queued chunks and hands (row, result) pairs, fanned out to cluster members, to the writer ---
+    def classify_sms_chunks(self, chunk_queue, result_queue, clusters, stop):
+        try:
+            while not stop.is_set():
+                try:
+                    chunk = chunk_queue.get(True, 0.5)
+                except Empty:
+                    continue
+                if chunk is _END_OF_STREAM:
+                    break
+                path, items = chunk
+                try:
+                    ai_results = self.process_with_llama_api_batch([row["body"] for _, row in items], path)
+                except Exception as e:
+                    self.log(Level.SEVERE, "Error classifying chunk of %d messages: %s" % (len(items), str(e)))
+                    ai_results = [None] * len(items)
+                for (cluster_id, row), ai_data in zip(items, ai_results):
+                    if cluster_id is None:
+                        result_queue.put((row, ai_data))
+                        continue
+                    for item in clusters.resolve(cluster_id, ai_data):
+                        result_queue.put(item)
+        except Exception as e:
+            self.log(Level.SEVERE, "Error in LLM worker: " + str(e))
+        finally:
+            result_queue.put(_END_OF_STREAM)
+
+    # --- Runs reader -> LLM workers -> writer for one database; artifacts are posted from the ingest thread only ---
+    # Returns (messages processed, messages that got no artifact).
+    def run_ingest_pipeline(self, resultSet, plan, ledger, file, blackboard, sms_artifact_type, progressBar):
+        chunk_queue = Queue(LLM_QUEUE_CHUNKS)
+        result_queue = Queue()
+        stop = threading.Event()
+        clusters = ClusterResults() if DEDUPE_ENABLED else None
+
+        reader = threading.Thread(target=self.read_sms_rows, args=(resultSet, plan, chunk_queue, result_queue, clusters, stop))
+        workers = [threading.Thread(target=self.classify_sms_chunks, args=(chunk_queue, result_queue, clusters, stop))
+                   for _ in range(LLM_WORKERS)]
+        reader.start()
+        for worker in workers:
+            worker.start()
+
+        processed = 0
+        failed = 0
+        artifacts = []
+        running_workers = len(workers)
+        while running_workers > 0:
+            if self.context.isJobCancelled():
+                stop.set()
+            try:
+                item = result_queue.get(True, 0.5)
+            except Empty:
+                continue
+            if item is _END_OF_STREAM:
+                running_workers -= 1
+                continue
+            if stop.is_set():
+                continue
+
+            row, ai_data = item
+            if not isinstance(ai_data, dict):
+                self.log(Level.INFO, "Error processing AI response for body: {}".format(row["body"]))
+                failed += 1
+            else:
+                artifact = self.create_sms_artifact(file, sms_artifact_type, row, ai_data)
+                if artifact is None:
+                    failed += 1
+                else:
+                    artifacts.append(artifact)
+                    if ledger is not None:
+                        ledger.record(file.getId(), row["key"], row["hash"], ai_data)
+                    if len(artifacts) >= ARTIFACT_POST_BATCH:
+                        self.post_artifact_batch(blackboard, artifacts)
+                        artifacts = []
+            processed += 1
+            progressBar.progress(file.getName(), processed)
+
+        self.post_artifact_batch(blackboard, artifacts)
+        stop.set()
+        reader.join()
+        for worker in workers:
+            worker.join()
+        return processed, failed
+
+    # --- Import-only pass: artifacts straight from precomputed results, no reader/worker threads and no server calls ---
+    # Returns (messages processed, messages without a precomputed result).
+    def import_precomputed_rows(self, resultSet, plan, precomputed, ledger, file, blackboard, sms_artifact_type, progressBar):
+        processed = 0
+        missing = 0
+        artifacts = []
+        while not self.context.isJobCancelled() and resultSet.next():
+            row = self.read_message_row(resultSet)
+            if row is None or (plan is not None and row["key"] in plan["skip"]):
+                continue
+            ai_data = precomputed.get(row["key"])
+            if ai_data is None and plan is not None:
+                ai_data = plan["reuse"].get(row["key"])
+            artifact = self.create_sms_artifact(file, sms_artifact_type, row, ai_data) if isinstance(ai_data, dict) else None
+            if artifact is None:
+                missing += 1
+            else:
+                artifacts.append(artifact)
+                if ledger is not None:
+                    ledger.record(file.getId(), row["key"], row["hash"], ai_data)
+                if len(artifacts) >= ARTIFACT_POST_BATCH:
+                    self.post_artifact_batch(blackboard, artifacts)
+                    artifacts = []
+            processed += 1
+            progressBar.progress(file.getName(), processed)
+
+        self.post_artifact_batch(blackboard, artifacts)
+        if missing:
+            self.log(Level.INFO, "%s: %d rows have no precomputed result" % (file.getName(), missing))
+        return processed, missing
+
+    # --- Creates one TSK_CUSTOM_SMS artifact with all LLM categories in a single insert, leaving missing values as "E" ---
+    # Thread, address, date and direction from the message row are added as standard attributes for conversation analysis.
+    def create_sms_artifact(self, file, sms_artifact_type, row, ai_data):
+        try:
+            moduleName = smsDbIngestModuleFactory.moduleName
+            attributes = ArrayList()
+            for attribute_type, reply_key in self.attribute_types:
+                value = row["body"] if reply_key is None else ai_data.get(reply_key, "E")
+                attributes.add(BlackboardAttribute(attribute_type, moduleName, value))
+
+            attributes.add(BlackboardAttribute(BlackboardAttribute.ATTRIBUTE_TYPE.TSK_MESSAGE_TYPE, moduleName, row["source"].upper()))
+            if row.get("thread_id") is not None:
+                attributes.add(BlackboardAttribute(BlackboardAttribute.ATTRIBUTE_TYPE.TSK_THREAD_ID, moduleName, str(row["thread_id"])))
+            if row.get("address"):
+                attributes.add(BlackboardAttribute(BlackboardAttribute.ATTRIBUTE_TYPE.TSK_PHONE_NUMBER, moduleName, row["address"]))
+            if row.get("date"):
+                attributes.add(BlackboardAttribute(BlackboardAttribute.ATTRIBUTE_TYPE.TSK_DATETIME, moduleName, long(row["date"]) // 1000))
+            if row.get("type") in MESSAGE_DIRECTIONS:
+                attributes.add(BlackboardAttribute(BlackboardAttribute.ATTRIBUTE_TYPE.TSK_DIRECTION, moduleName, MESSAGE_DIRECTIONS[row["type"]]))
+            return file.newDataArtifact(sms_artifact_type, attributes)
+        except Exception as e:
+            self.log(Level.INFO, "Error creating ARTIFACT for body: {}. Error: {}".format(row["body"], str(e)))
+            return None
+
+    # --- Posts a batch of created artifacts to the blackboard in one call (indexing and UI events) ---
+    def post_artifact_batch(self, blackboard, artifacts):
+        if not artifacts:
+            return
+        try:
+            blackboard.postArtifacts(ArrayList(artifacts), smsDbIngestModuleFactory.moduleName)
+        except Exception as e:
+            self.log(Level.WARNING, "Error posting %d artifacts: %s" % (len(artifacts), str(e)))
+
+    # --- Opens mmssms.db read-only in place when Autopsy already has it on local disk, otherwise from a temp copy ---
+    # Returns (connection, temp copy path or None); the connection is None if the database could not be opened.
+    def open_message_db(self, file):
+        Class.forName("org.sqlite.JDBC").newInstance()
+        localPath = file.getLocalAbsPath() if READ_LOCAL_DB_IN_PLACE else None
+        if localPath and os.path.isfile(localPath):
+            try:
+                config = SQLiteConfig()
+                config.setReadOnly(True)
+                return DriverManager.getConnection("jdbc:sqlite:%s" % localPath, config.toProperties()), None
+            except SQLException as e:
+                self.log(Level.INFO, "Could not open %s in place, copying it instead: %s" % (localPath, e.getMessage()))
+
+        lclDbPath = os.path.join(Case.getCurrentCase().getTempDirectory(), str(file.getId()) + ".db")
+        ContentUtils.writeToFile(file, File(lclDbPath))
+        try:
+            return DriverManager.getConnection("jdbc:sqlite:%s" % lclDbPath), lclDbPath
+        except SQLException as e:
+            self.log(Level.INFO, "Could not open database file: " + file.getName())
+            os.remove(lclDbPath)
+            return None, None
+
+    # --- Closes the statement and connection opened by open_message_db and removes its temp copy, if any ---
+    def close_message_db(self, dbConn, stmt, lclDbPath):
+        try:
+            if stmt is not None:
+                stmt.close()
+            dbConn.close()
+        except SQLException as e:
+            self.log(Level.INFO, "Error closing database: " + e.getMessage())
+        if lclDbPath is not None and os.path.exists(lclDbPath):
+            os.remove(lclDbPath)
+
 # --- Main processing loop: finds mmssms.db, parses SMS messages, sends them to LLM, creates artifacts ---
     def process(self, dataSource, progressBar):
 
@@ -176,108 +601,89 @@ class smsDbIngestModule(DataSourceIngestModule):
         fileManager = Case.getCurrentCase().getServices().getFileManager()
         files = fileManager.findFiles(dataSource, "mmssms.db")
 
-        numFiles = len(files)
-        progressBar.switchToDeterminate(numFiles)
-        fileCount = 0
-
-        for file in files:
-            if self.context.isJobCancelled():
-                return IngestModule.ProcessResult.OK
+        ledger = None
+        if INCREMENTAL_INGEST:
+            ledgerDir = os.path.join(Case.getCurrentCase().getModuleDirectory(), smsDbIngestModuleFactory.moduleName)
+            if not os.path.exists(ledgerDir):
+                os.makedirs(ledgerDir)
+            ledger = IngestLedger(os.path.join(ledgerDir, "ingest_ledger.db"))
 
-            self.log(Level.INFO, "Processing file: " + file.getName())
-            fileCount += 1
+        sidecar = PrecomputedResults(PRECOMPUTED_RESULTS_PATH) if PRECOMPUTED_RESULTS_PATH else None
 
-            lclDbPath = os.path.join(Case.getCurrentCase().getTempDirectory(), str(file.getId()) + ".db")
-            ContentUtils.writeToFile(file, File(lclDbPath))
+        fileCount = 0
+        messageCount = 0
 
-            try:
-                Class.forName("org.sqlite.JDBC").newInstance()
-                dbConn = DriverManager.getConnection("jdbc:sqlite:%s" % lclDbPath)
-            except SQLException as e:
-                self.log(Level.INFO, "Could not open database file: " + file.getName())
-                continue
+        try:
+            for file in files:
+                if self.context.isJobCancelled():
+                    return IngestModule.ProcessResult.OK
 
-            try:
-                stmt = dbConn.createStatement()
-                resultSet = stmt.executeQuery("SELECT body FROM sms")
-            except SQLException as e:
-                self.log(Level.INFO, "Error querying database: " + e.getMessage())
-                continue
+                self.log(Level.INFO, "Processing file: " + file.getName())
+                fileCount += 1
 
-            while resultSet.next():
-                try:
-                    body = resultSet.getString("body")
-                except SQLException:
+                dbConn, lclDbPath = self.open_message_db(file)
+                if dbConn is None:
                     continue
 
-                # Process SMS text with AI or handle it
-                ai_data = {
-                    "PERSON": "E", "ORG": "E", "GPE": "E", "NORP": "E", "DATE": "E", 
-                    "TIME": "E", "MONEY": "E", "PERCENT": "E", "FAC": "E", 
-                    "PRODUCT": "E", "WORK_OF_ART": "E", "LANGUAGE": "E", 
-                    "EVENT": "E", "LAW": "E", "ORDINAL": "E", "CARDINAL": "E"
-                }
-
+                plan = None
+                stmt = None
                 try:
-                    ai_response = self.process_with_llama_api(body)
-                    import json
-                    ai_data = json.loads(ai_response)
-                except (json.JSONDecodeError, Exception) as e:
-                    self.log(Level.INFO, "Error processing AI response for body: {}. Error: {}".format(body, str(e)))
+                    query = self.build_message_query(dbConn)
+                    stmt = dbConn.createStatement()
+                    stmt.setFetchSize(SMS_FETCH_SIZE)
+                    if ledger is not None:
+                        plan = self.plan_incremental_run(stmt, query, file.getId(), ledger)
+                        totalRows = plan["row_count"] - len(plan["skip"])
+                    else:
+                        countSet = stmt.executeQuery("SELECT COUNT(*) FROM (" + query + ")")
+                        totalRows = countSet.getInt(1) if countSet.next() else 0
+                        countSet.close()
+                    resultSet = stmt.executeQuery(query)
+                except SQLException as e:
+                    self.log(Level.INFO, "Error querying database: " + e.getMessage())
+                    self.close_message_db(dbConn, stmt, lclDbPath)
                     continue
 
-                # Create artifact with explicit attributes, leaving other values blank if there's an error
-                try:
-                    artifact = file.newArtifact(sms_artifact_type.getTypeID())
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_SMS_TEXT"), smsDbIngestModuleFactory.moduleName, body))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_TAGS"), smsDbIngestModuleFactory.moduleName, ai_data.get("TAGS", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_PERSON"), smsDbIngestModuleFactory.moduleName, ai_data.get("PERSON", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_ORGANIZATION"), smsDbIngestModuleFactory.moduleName, ai_data.get("ORG", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_GPE"), smsDbIngestModuleFactory.moduleName, ai_data.get("GPE", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_NORP"), smsDbIngestModuleFactory.moduleName, ai_data.get("NORP", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_DATE"), smsDbIngestModuleFactory.moduleName, ai_data.get("DATE", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_TIME"), smsDbIngestModuleFactory.moduleName, ai_data.get("TIME", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_MONEY"), smsDbIngestModuleFactory.moduleName, ai_data.get("MONEY", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_PERCENT"), smsDbIngestModuleFactory.moduleName, ai_data.get("PERCENT", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_FAC"), smsDbIngestModuleFactory.moduleName, ai_data.get("FAC", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_PRODUCT"), smsDbIngestModuleFactory.moduleName, ai_data.get("PRODUCT", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_WORK_OF_ART"), smsDbIngestModuleFactory.moduleName, ai_data.get("WORK_OF_ART", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_LANGUAGE"), smsDbIngestModuleFactory.moduleName, ai_data.get("LANGUAGE", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_EVENT"), smsDbIngestModuleFactory.moduleName, ai_data.get("EVENT", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_LAW"), smsDbIngestModuleFactory.moduleName, ai_data.get("LAW", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_ORDINAL"), smsDbIngestModuleFactory.moduleName, ai_data.get("ORDINAL", "E")))
-                    artifact.addAttribute(BlackboardAttribute(
-                        blackboard.getAttributeType("TSK_CARDINAL"), smsDbIngestModuleFactory.moduleName, ai_data.get("CARDINAL", "E")))
-
-                    blackboard.postArtifact(artifact, smsDbIngestModuleFactory.moduleName)
-                except Exception as e:
-                   self.log(Level.INFO, "Error posting ARTIFACT for body: {}. Error: {}".format(body, str(e)))
-                   continue
-
-
-            stmt.close()
-            dbConn.close()
-            os.remove(lclDbPath)
+                if plan is not None:
+                    self.log(Level.INFO, "%s: %d rows, %d already classified, %d reused from earlier results" % (
+                        file.getName(), plan["row_count"], len(plan["skip"]), len(plan["reuse"])))
+
+                precomputed = self.load_precomputed(sidecar, file) if sidecar is not None and totalRows > 0 else None
+                if precomputed is not None and not PRECOMPUTED_ONLY:
+                    # hybrid: precomputed rows take the ledger's reuse path, the rest still go to the server
+                    if plan is None:
+                        plan = {"skip": set(), "reuse": {}}
+                    for key, result in precomputed.items():
+                        if key not in plan["skip"]:
+                            plan["reuse"][key] = result
+
+                processed = 0
+                failed = 0
+                if totalRows > 0:
+                    progressBar.switchToDeterminate(totalRows)
+                    if sidecar is not None and PRECOMPUTED_ONLY:
+                        processed, failed = self.import_precomputed_rows(resultSet, plan, precomputed or {}, ledger, file, blackboard, sms_artifact_type, progressBar)
+                    else:
+                        processed, failed = self.run_ingest_pipeline(resultSet, plan, ledger, file, blackboard, sms_artifact_type, progressBar)
+                    messageCount += processed
+
+                resultSet.close()
+                self.close_message_db(dbConn, stmt, lclDbPath)
+
+                if self.context.isJobCancelled():
+                    return IngestModule.ProcessResult.OK
+
+                # Only a fully classified file gets a watermark, so failed or unread rows are retried on the next run
+                if processed < totalRows:
+                    self.log(Level.WARNING, "%s: only %d of %d rows reached the writer" % (file.getName(), processed, totalRows))
+                if ledger is not None and failed == 0 and processed == totalRows:
+                    ledger.set_watermark(file.getId(), plan["max_id"], plan["row_count"], plan["content_hash"])
+        finally:
+            if ledger is not None:
+                ledger.close()
 
         message = IngestMessage.createMessage(IngestMessage.MessageType.DATA,
-                                            "LLM DFIR PLUGIN", "Processed %d messages" % fileCount)
+                                            "LLM DFIR PLUGIN", "Processed %d messages from %d files" % (messageCount, fileCount))
         IngestServices.getInstance().postMessage(message)
 
         return IngestModule.ProcessResult.OK
@@ -0,0 +1,217 @@
+# --- Exact and near-duplicate SMS clustering used by the ingest module before sending messages to the LLM ---
+# Pure Python so it runs under Autopsy's Jython 2.7 as well as CPython.
+
+import difflib
+import re
+import threading
+import zlib
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+_TOKEN_RE = re.compile(r"\w+(?:[.,:/'-]\w+)*", re.UNICODE)
+_DIGITS_RE = re.compile(r"\d+")
+
+# --- Fields whose values are copied verbatim from the representative; everything else is re-mapped per member ---
+_UNMAPPED_FIELDS = ("TAGS",)
+
+# --- Large Mersenne prime used for the MinHash permutations ---
+_PRIME = (1 << 61) - 1
+
+
+# --- Normalisation: case and whitespace differences never create a new cluster ---
+def normalize_body(body):
+    return " ".join(body.lower().split())
+
+
+# --- Template form: digit runs are masked so OTPs and alerts that only differ in numbers collapse together ---
+def body_template(normalized):
+    return _DIGITS_RE.sub("#", normalized)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text)
+
+
+# --- Cluster Index: assigns every message to a cluster, creating one when no exact or near match exists ---
+class SmsClusterIndex(object):
+    """
+    Groups SMS bodies by normalised text, then by digit-masked template, then by
+    MinHash similarity of word shingles (LSH banded) for template-style texts
+    that differ in a few words, e.g. a bank alert with another merchant name.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=32, bands=8, shingle_size=3):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        self._exact = {}
+        self._bodies = {}
+        self._templates = {}
+        self._signatures = {}
+        self._buckets = {}
+        self._next_id = 0
+        self._perms = [(1 + 2 * i * 7919 + 104729, 31 * i + 17) for i in range(num_perm)]
+
+        self.messages = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.near_rejected = 0
+
+    def __len__(self):
+        return self._next_id
+
+    # --- Returns (cluster_id, is_new); is_new means the body is the cluster's representative. A near match that
+    #     could not take over its cluster's result (see token_map) becomes a representative and is counted in near_rejected ---
+    def assign(self, body):
+        self.messages += 1
+        normalized = normalize_body(body)
+        cluster_id = self._exact.get(normalized)
+        if cluster_id is not None:
+            self.exact_hits += 1
+            return cluster_id, False
+
+        # a near match only joins a cluster if the representative's result can be re-mapped to it token for token
+        template = body_template(normalized)
+        signature = None
+        cluster_id = self._templates.get(template)
+        rejected = cluster_id is not None and token_map(self._bodies[cluster_id], body) is None
+        if rejected:
+            cluster_id = None
+        if cluster_id is None:
+            signature = self._signature(template)
+            if signature is not None:
+                cluster_id, rejected_similar = self._find_similar(signature, body)
+                rejected = rejected or rejected_similar
+        if cluster_id is not None:
+            self.near_hits += 1
+            self._exact[normalized] = cluster_id
+            return cluster_id, False
+        if rejected:
+            self.near_rejected += 1
+
+        cluster_id = self._next_id
+        self._next_id += 1
+        self._exact[normalized] = cluster_id
+        self._bodies[cluster_id] = body
+        self._templates.setdefault(template, cluster_id)
+        if signature is not None:
+            self._signatures[cluster_id] = signature
+            for band in self._bands(signature):
+                self._buckets.setdefault(band, []).append(cluster_id)
+        return cluster_id, True
+
+    def _signature(self, template):
+        tokens = template.split()
+        if len(tokens) < self.shingle_size:
+            return None
+        shingles = set()
+        for i in range(len(tokens) - self.shingle_size + 1):
+            shingles.add(zlib.crc32(" ".join(tokens[i:i + self.shingle_size]).encode("utf-8")) & 0xffffffff)
+        return tuple(min((a * s + b) % _PRIME for s in shingles) for a, b in self._perms)
+
+    def _bands(self, signature):
+        for band in range(self.bands):
+            yield (band,) + signature[band * self.rows:(band + 1) * self.rows]
+
+    def _find_similar(self, signature, body):
+        best_id = None
+        best_score = self.threshold
+        rejected = False
+        seen = set()
+        for band in self._bands(signature):
+            for cluster_id in self._buckets.get(band, ()):
+                if cluster_id in seen:
+                    continue
+                seen.add(cluster_id)
+                other = self._signatures[cluster_id]
+                score = sum(1 for x, y in zip(signature, other) if x == y) / float(self.num_perm)
+                if score >= best_score:
+                    if token_map(self._bodies[cluster_id], body) is None:
+                        rejected = True
+                        continue
+                    best_id, best_score = cluster_id, score
+        return best_id, rejected
+
+
+# --- Token Re-mapping: {rep token: member token} when the two bodies differ only by 1:1 token replacements, else None ---
+# Insertions, deletions, replacements of unequal length, or one token replaced two different ways cannot be re-mapped
+# into the representative's values safely, so such a member is classified on its own.
+def token_map(rep_body, member_body):
+    rep_tokens = tokenize(rep_body)
+    member_tokens = tokenize(member_body)
+    mapping = {}
+    matcher = difflib.SequenceMatcher(None, rep_tokens, member_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if tag != "replace" or i2 - i1 != j2 - j1:
+            return None
+        for old, new in zip(rep_tokens[i1:i2], member_tokens[j1:j2]):
+            if mapping.setdefault(old, new) != new:
+                return None
+    return mapping
+
+
+# --- Fan-out: adapts the representative's LLM result to a member by re-mapping the tokens that differ
+#     (None if the member cannot be re-mapped, so it is counted as failed and retried rather than given wrong values) ---
+def transfer_result(rep_body, rep_result, member_body):
+    if rep_body == member_body or not isinstance(rep_result, dict):
+        return rep_result
+
+    mapping = token_map(rep_body, member_body)
+    if mapping is None:
+        return None
+    if not mapping:
+        return rep_result
+
+    result = {}
+    for key, value in rep_result.items():
+        if key not in _UNMAPPED_FIELDS and isinstance(value, string_types):
+            value = _TOKEN_RE.sub(lambda m: mapping.get(m.group(0), m.group(0)), value)
+        result[key] = value
+    return result
+
+
+# --- Cluster Results: holds each representative's result so members are answered without another LLM call ---
+class ClusterResults(object):
+    """
+    Thread-safe hand-off between the reader (which sees members) and the LLM
+    workers (which resolve representatives). Rows are dicts with at least a
+    "body" key; members arriving before their representative is classified are
+    parked and released by resolve().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clusters = {}
+
+    def add_representative(self, cluster_id, row):
+        with self._lock:
+            self._clusters[cluster_id] = {"row": row, "done": False, "result": None, "waiting": []}
+
+    # --- Returns [(row, result)] if the representative is already classified, otherwise parks the member ---
+    def add_member(self, cluster_id, row):
+        with self._lock:
+            cluster = self._clusters[cluster_id]
+            if not cluster["done"]:
+                cluster["waiting"].append(row)
+                return []
+            rep_body, rep_result = cluster["row"]["body"], cluster["result"]
+        return [(row, transfer_result(rep_body, rep_result, row["body"]))]
+
+    # --- Records the representative's result and returns it together with every parked member's result ---
+    def resolve(self, cluster_id, result):
+        with self._lock:
+            cluster = self._clusters[cluster_id]
+            cluster["done"] = True
+            cluster["result"] = result
+            waiting, cluster["waiting"] = cluster["waiting"], []
+            rep_row = cluster["row"]
+        return [(rep_row, result)] + [(row, transfer_result(rep_row["body"], result, row["body"])) for row in waiting]
@@ -1,6 +1,13 @@
 import pandas as pd
+import argparse
+import hashlib
 import json
+import os
+import sqlite3
+import threading
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tabulate import tabulate
 import logging
 from deepeval.metrics import GEval
@@ -13,24 +20,59 @@ log_file = "program_log_with_a12.txt"
 logging.basicConfig(
     filename=log_file,
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
+    format="%(asctime)s - %(levelname)s - %(threadName)s - %(message)s",
     datefmt="%Y-%m-%d %H:%M:%S"
 )
 
-# Log the start of the program
-logging.info("Program started.")
+input_csv_path = "../data_group/output_conversations_a12.csv"
+output_csv_path = 'ollama_responses_with_evaluation_a12.csv'
+# Append-only results log (one JSON line per finished conversation); the CSV above is exported from it
+results_log_path = 'ollama_responses_with_evaluation_a12.jsonl'
+
+# -------------------------
+# Concurrency Limits
+# -------------------------
+# Conversations are processed by a worker pool; generation and judging have separate limits so neither the
+# local model nor the judge API is overrun. Keep generation_workers <= OLLAMA_NUM_PARALLEL on the Ollama host.
+# (1 and 1 reproduces the original one-conversation-at-a-time run.)
+generation_workers = 2
+judge_workers = 4
+
+# -------------------------
+# Refinement Budget
+# -------------------------
+# A conversation is regenerated until its G-Eval score reaches pass_score, at most max_attempts times; every retry
+# also draws from a budget shared by the whole run. The best-scoring attempt is kept either way.
+pass_score = 80
+max_attempts = 3
+run_retry_budget = 500
+
+# Judge scores are cached on disk by (conversation hash, summary hash, judge criteria hash)
+judge_cache_path = 'judge_cache_a12.db'
+
+# -------------------------
+# Context Budget
+# -------------------------
+# A conversation whose prompt would not fit in num_ctx (less room for the summary) is summarised map-reduce style:
+# token-budgeted chunks of messages are summarised concurrently, then the chunk summaries are merged into one.
+# Chunks are cut greedily from the first message, so new messages only change the tail chunk; chunk summaries are
+# cached on disk by prompt text, so only that chunk is summarised again.
+summary_reserve_tokens = 512
+chars_per_token = 4  # rough estimate for English chat text
+chunk_cache_path = 'chunk_cache_a12.db'
 
 # -------------------------
 # 2. Load and Prepare Data
 # -------------------------
-input_csv_path = "../data_group/output_conversations_a12.csv"
-try:
-    df = pd.read_csv(input_csv_path)
-    df['Date/Time'] = pd.to_datetime(df['Date/Time'], utc=True)
-    logging.info(f"Successfully loaded {len(df)} rows from {input_csv_path}")
-except Exception as e:
-    logging.error(f"Error loading input CSV: {e}")
-    raise
+def load_conversations(path):
+    try:
+        df = pd.read_csv(path)
+        df['Date/Time'] = pd.to_datetime(df['Date/Time'], utc=True)
+        logging.info(f"Successfully loaded {len(df)} rows from {path}")
+    except Exception as e:
+        logging.error(f"Error loading input CSV: {e}")
+        raise
+    return df
 
 # --------------------------------------------
 # 3. Function to Build the Prompt for LLM
@@ -38,7 +80,7 @@ except Exception as e:
 def build_prompt(convo_id, messages_df):
     """
     Constructs a prompt for the LLM to generate a conversation summary.
-    
+
     For each message, the format is:
       "[Date/Time] - [Source Name] ([Message Type]): [Text]"
     """
@@ -46,19 +88,53 @@ def build_prompt(convo_id, messages_df):
     prompt_lines.append("Please generate a concise summary of the conversation below.")
     prompt_lines.append(f"Conversation ID: {convo_id}")
     prompt_lines.append("Messages:")
-    
+    prompt_lines.extend(message_lines(messages_df))
+
+    return "\n".join(prompt_lines)
+
+def message_lines(messages_df):
+    lines = []
     for _, row in messages_df.iterrows():
         dt_str = row['Date/Time'].strftime('%Y-%m-%d %H:%M:%S')
-        source_name = row['Source Name']
-        line = f"{dt_str} - ({row['Message Type']}): {row['Text']}"
-        prompt_lines.append(line)
-    
-    return "\n".join(prompt_lines)
+        lines.append(f"{dt_str} - ({row['Message Type']}): {row['Text']}")
+    return lines
+
+# The conversation as the judge sees it (G-Eval input)
+def format_messages(messages_df):
+    return "\n".join(messages_df.apply(
+        lambda row: f"{row['Date/Time'].strftime('%Y-%m-%d %H:%M:%S')} - {row['Source Name']} ({row['Message Type']}): {row['Text']}",
+        axis=1
+    ))
+
+# --------------------------------------------
+# Conversation Fingerprints: a stored summary is reused while its conversation is unchanged
+# --------------------------------------------
+def conversation_fingerprint(messages_df):
+    return {
+        "message_count": len(messages_df),
+        "last_message": messages_df['Date/Time'].max().isoformat(),
+        "content_hash": sha256_hex(format_messages(messages_df)),
+    }
+
+def fingerprint_matches(record, fingerprint):
+    return all(record.get(key) == value for key, value in fingerprint.items())
+
+# Messages added since `record` was summarised, or None if earlier messages changed too (then a full summary is needed)
+def delta_messages(record, messages_df):
+    count = record.get("message_count")
+    if not record.get("summary") or not isinstance(count, int) or not 0 < count < len(messages_df):
+        return None
+    if sha256_hex(format_messages(messages_df.iloc[:count])) != record.get("content_hash"):
+        return None
+    return messages_df.iloc[count:]
 
 # --------------------------------------------
 # 4. Define Ollama API Details and Payload Schema
 # --------------------------------------------
 ollama_url = "http://192.168.88.234:11434/api/generate"
+ollama_model = "gemma2:9b"
+num_ctx = 4096  # override with --num-ctx; the model's own limit is the ceiling
+request_timeout = 30
 
 # The payload now only expects the "summary" field in the response.
 payload_schema = {
@@ -69,160 +145,546 @@ payload_schema = {
     "required": ["summary"]
 }
 
+# Extracts the "summary" field from an Ollama /api/generate reply
+def parse_summary(response, convo_id):
+    try:
+        response_json = response.json()
+    except Exception as json_err:
+        logging.error(f"Error parsing JSON for Conversation ID {convo_id}: {json_err}")
+        response_json = None
+
+    # Retrieve the "response" field from the API reply
+    if response_json and isinstance(response_json, dict):
+        raw_resp = response_json.get("response", {})
+        if isinstance(raw_resp, str):
+            try:
+                response_data = json.loads(raw_resp)
+            except json.JSONDecodeError:
+                response_data = raw_resp
+        else:
+            response_data = raw_resp
+    else:
+        response_data = response_json if response_json is not None else response.text
+
+    if isinstance(response_data, dict):
+        return response_data.get("summary", "")
+    return ""
+
+# One Ollama call, holding a generation slot for its duration
+def generate_summary(ctx, convo_id, prompt):
+    payload = {
+        "model": ollama_model,
+        "prompt": prompt,
+        "stream": False,
+        "format": payload_schema,
+        "options": {
+            "num_ctx": ctx.num_ctx
+        }
+    }
+    with ctx.generation_slots:
+        response = ctx.session.post(ollama_url, json=payload, timeout=request_timeout)
+    response.raise_for_status()
+    ctx.count("generations")
+    return parse_summary(response, convo_id)
+
+# --------------------------------------------
+# Long Conversations: Token-Budgeted Map-Reduce
+# --------------------------------------------
+def estimate_tokens(text):
+    return len(text) // chars_per_token + 1
+
+# Greedy split of lines into chunks of at most `budget` tokens; an oversized line is cut to fit on its own
+def split_chunks(lines, budget):
+    chunks = [[]]
+    used = 0
+    for line in lines:
+        tokens = estimate_tokens(line)
+        if tokens > budget:
+            line = line[:budget * chars_per_token] + " [...]"
+            tokens = budget
+        if chunks[-1] and used + tokens > budget:
+            chunks.append([])
+            used = 0
+        chunks[-1].append(line)
+        used += tokens
+    return chunks
+
+def chunk_prompt(convo_id, part, lines):
+    return "\n".join([
+        f"Please generate a concise summary of part {part} of the conversation below, keeping names, dates, "
+        "amounts and any events of investigative interest.",
+        f"Conversation ID: {convo_id}",
+        "Messages:"
+    ] + lines)
+
+def update_prompt(convo_id, previous_summary, lines):
+    return "\n".join([
+        "Below is the existing summary of a conversation, followed by the messages added since it was written. "
+        "Please generate a concise updated summary of the whole conversation that keeps what still matters from the "
+        "existing summary and adds the key points of the new messages.",
+        f"Conversation ID: {convo_id}",
+        f"Existing summary: {previous_summary}",
+        "New messages:"
+    ] + lines)
+
+def merge_prompt(convo_id, summaries):
+    return "\n".join([
+        "Below are summaries of consecutive parts of one conversation, in order. "
+        "Please merge them into one concise summary of the whole conversation.",
+        f"Conversation ID: {convo_id}",
+        "Part summaries:"
+    ] + [f"[{i}] {summary}" for i, summary in enumerate(summaries, 1)])
+
+class ChunkCache:
+    """SQLite cache of chunk and partial-merge summaries, keyed by model, num_ctx and prompt text."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunk_summaries (key TEXT PRIMARY KEY, summary TEXT, created REAL)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM chunk_summaries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, summary):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO chunk_summaries VALUES (?, ?, ?)", (key, summary, time.time()))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def cached_summary(ctx, convo_id, prompt):
+    key = sha256_hex("\x1f".join([ollama_model, str(ctx.num_ctx), prompt]))
+    summary = ctx.chunk_cache.get(key)
+    if summary is None:
+        summary = generate_summary(ctx, convo_id, prompt)
+        if summary:
+            ctx.chunk_cache.put(key, summary)
+    return summary
+
+# Map: chunk summaries in parallel; reduce: merge groups of summaries until one merge prompt fits the budget.
+# Returns the final merge prompt (not cached, since refinement retries regenerate it) and the number of chunks.
+def map_reduce_prompt(ctx, convo_id, lines):
+    budget = ctx.num_ctx - summary_reserve_tokens
+    overhead = estimate_tokens(chunk_prompt(convo_id, 0, []))
+    chunks = split_chunks(lines, budget - overhead)
+    summaries = list(ctx.chunk_executor.map(
+        lambda item: cached_summary(ctx, convo_id, chunk_prompt(convo_id, item[0], item[1])),
+        enumerate(chunks, 1)))
+    logging.info(f"Conversation ID {convo_id}: {len(lines)} messages summarised in {len(chunks)} chunks.")
+
+    while len(summaries) > 1 and estimate_tokens(merge_prompt(convo_id, summaries)) > budget:
+        groups = split_chunks(summaries, budget - estimate_tokens(merge_prompt(convo_id, [])))
+        if len(groups) == len(summaries):
+            break  # every summary already fills the budget on its own
+        summaries = list(ctx.chunk_executor.map(
+            lambda group: group[0] if len(group) == 1 else cached_summary(ctx, convo_id, merge_prompt(convo_id, group)),
+            groups))
+    return merge_prompt(convo_id, summaries), len(chunks)
+
+# The prompt for the final summary, with the number of chunks and the mode:
+#   "incremental"  the previous summary plus only the new messages, when that fits in the context budget
+#   "full"         the whole conversation, or its map-reduce merge (unchanged chunks come from the chunk cache)
+def summary_prompt(ctx, convo_id, group, previous=None, delta=None):
+    budget = ctx.num_ctx - summary_reserve_tokens
+    if delta is not None:
+        prompt = update_prompt(convo_id, previous["summary"], message_lines(delta))
+        if estimate_tokens(prompt) <= budget:
+            return prompt, 0, "incremental"
+    prompt = build_prompt(convo_id, group)
+    if estimate_tokens(prompt) <= budget:
+        return prompt, 0, "full"
+    prompt, chunks = map_reduce_prompt(ctx, convo_id, message_lines(group))
+    return prompt, chunks, "full"
+
 # --------------------------------------------
 # 5. Define G-Eval Metric for Evaluation
 # --------------------------------------------
+judge_criteria = "Determine whether the summary accurately reflects the conversation messages."
+judge_steps = [
+    "Check if the summary captures the key points of the conversation.",
+    "Ensure no important details are omitted from the summary.",
+    "Verify that the summary does not introduce any incorrect information."
+]
+
 def create_geval_metric():
     correctness_metric = GEval(
         name="Correctness",
-        criteria="Determine whether the summary accurately reflects the conversation messages.",
-        evaluation_steps=[
-            "Check if the summary captures the key points of the conversation.",
-            "Ensure no important details are omitted from the summary.",
-            "Verify that the summary does not introduce any incorrect information."
-        ],
+        criteria=judge_criteria,
+        evaluation_steps=judge_steps,
         evaluation_params=[
             LLMTestCaseParams.INPUT,
             LLMTestCaseParams.ACTUAL_OUTPUT
         ],
+        async_mode=False,  # measured inside worker threads, no event loop of its own
         verbose_mode=True
     )
     return correctness_metric
 
+def sha256_hex(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class JudgeCache:
+    """
+    SQLite cache of G-Eval results. The key covers the conversation text, the summary
+    and the judge criteria, so a changed rubric never reuses old scores.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.criteria_hash = sha256_hex(json.dumps([judge_criteria, judge_steps]))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS judge_scores (key TEXT PRIMARY KEY, score REAL, reason TEXT, created REAL)")
+        self._conn.commit()
+
+    def make_key(self, convo_hash, summary):
+        return sha256_hex("\x1f".join([convo_hash, sha256_hex(summary), self.criteria_hash]))
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT score, reason FROM judge_scores WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row
+
+    def put(self, key, score, reason):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO judge_scores VALUES (?, ?, ?, ?)", (key, score, reason, time.time()))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# One G-Eval judgement (or a cached one), holding a judge slot; a fresh metric per call since GEval keeps its score on the instance
+def judge_summary(ctx, convo_hash, messages, summary):
+    key = ctx.judge_cache.make_key(convo_hash, summary)
+    cached = ctx.judge_cache.get(key)
+    if cached is not None:
+        return cached[0], cached[1], "(cached judgement)"
+
+    metric = create_geval_metric()
+    test_case = LLMTestCase(
+        input=messages,
+        actual_output=summary
+    )
+    with ctx.judge_slots:
+        metric.measure(test_case)
+    ctx.count("judge_calls")
+    score = metric.score * 100  # score as a percentage
+    ctx.judge_cache.put(key, score, metric.reason)
+    return score, metric.reason, metric.verbose_logs
+
 # --------------------------------------------
-# 6. Process Each Conversation, Send Request, & Collect Responses
+# 6. Summarise One Conversation: generate, judge, and refine within the attempt and run budgets
 # --------------------------------------------
-output_csv_path = 'ollama_responses_with_evaluation_a12.csv'
+class RunContext:
+    """
+    Shared state for the worker threads: HTTP session, stage limits, caches, attempt and
+    retry budgets, context size, counters, and the pool used for chunk summaries.
+    """
 
-# Initialize an empty DataFrame to store responses
-try:
-    # Try to load existing CSV file if it exists
-    responses_df = pd.read_csv(output_csv_path)
-    logging.info(f"Loaded existing responses from {output_csv_path}.")
-except FileNotFoundError:
-    # If the file doesn't exist, create an empty DataFrame
-    responses_df = pd.DataFrame(columns=["Conversation_ID", "summary", "evaluation_score", "evaluation_reason"])
-    logging.info(f"No existing responses found. Starting fresh.")
-
-geval_metric = create_geval_metric()
-
-for convo_id, group in df.groupby("Conversation_ID"):
-    # Skip conversations already processed
-    if convo_id in responses_df["Conversation_ID"].values:
-        logging.info(f"Skipping already processed Conversation ID {convo_id}.")
-        continue
-
-    messages = "\n".join(group.apply(
-        lambda row: f"{row['Date/Time'].strftime('%Y-%m-%d %H:%M:%S')} - {row['Source Name']} ({row['Message Type']}): {row['Text']}",
-        axis=1
-    ))
-    
+    def __init__(self, session, generation_slots, judge_slots, judge_cache, max_attempts, retry_budget,
+                 num_ctx, chunk_cache, chunk_executor):
+        self.session = session
+        self.generation_slots = generation_slots
+        self.judge_slots = judge_slots
+        self.judge_cache = judge_cache
+        self.num_ctx = num_ctx
+        self.chunk_cache = chunk_cache
+        self.chunk_executor = chunk_executor
+        self.max_attempts = max_attempts
+        self.retry_budget = retry_budget
+        self.counters = {"generations": 0, "judge_calls": 0, "retries": 0, "retries_denied": 0, "failed_updates": 0}
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    # --- A retry is allowed while the run-wide budget lasts ---
+    def take_retry(self):
+        with self._lock:
+            if self.counters["retries"] >= self.retry_budget:
+                self.counters["retries_denied"] += 1
+                return False
+            self.counters["retries"] += 1
+            return True
+
+# Feedback for the next attempt: the best summary so far, its score and the judge's reason
+def refinement_note(summary, score, reason):
+    return (
+        f"\n\nA previous summary of this conversation scored {score:.0f}% (pass mark {pass_score}%)."
+        f"\nJudge feedback: {reason}"
+        f"\nPrevious summary: {summary}"
+        "\nPlease write an improved summary that fixes these issues and better captures the key points of the conversation."
+    )
+
+# Returns the result record, or None when a stored summary could not be updated (the stored one is kept)
+def summarise_conversation(convo_id, group, ctx, previous=None):
+    messages = format_messages(group)
+    convo_hash = sha256_hex(messages)
+    fingerprint = conversation_fingerprint(group)
+    delta = delta_messages(previous, group) if previous is not None else None
+
+    # Build the prompt once (incremental update or map-reduce where possible); each retry adds feedback on the best attempt so far
+    base_prompt = prompt = None
+    chunks = 0
+    mode = "full"
+    best = None
     attempt = 1
     while True:
         logging.info(f"Processing Conversation ID {convo_id}, Attempt {attempt}")
-        
-        # Build the prompt
-        prompt = build_prompt(convo_id, group)
-        
-        # Send request to Ollama API
-        payload = {
-            "model": "gemma2:9b",
-            "prompt": prompt,
-            "stream": False,
-            "format": payload_schema,
-            "options": {
-                "num_ctx": 4096
-            }
-        }
-        
+
         try:
-            response = requests.post(ollama_url, json=payload, timeout=30)
-            response.raise_for_status()
-            
-            # Parse the response JSON
-            try:
-                response_json = response.json()
-            except Exception as json_err:
-                logging.error(f"Error parsing JSON for Conversation ID {convo_id}: {json_err}")
-                response_json = None
-            
-            # Retrieve the "response" field from the API reply
-            if response_json and isinstance(response_json, dict):
-                raw_resp = response_json.get("response", {})
-                if isinstance(raw_resp, str):
-                    try:
-                        response_data = json.loads(raw_resp)
-                    except json.JSONDecodeError:
-                        response_data = raw_resp
-                else:
-                    response_data = raw_resp
-            else:
-                response_data = response_json if response_json is not None else response.text
-            
-            # Extract the summary
-            if isinstance(response_data, dict):
-                summary = response_data.get("summary", "")
-            else:
-                summary = ""
-            
+            if base_prompt is None:
+                base_prompt, chunks, mode = summary_prompt(ctx, convo_id, group, previous, delta)
+                if mode == "incremental":
+                    logging.info(f"Conversation ID {convo_id}: updating the previous summary with {len(delta)} new messages.")
+                prompt = base_prompt
+            summary = generate_summary(ctx, convo_id, prompt)
+
             # Evaluate the summary using G-Eval
-            test_case = LLMTestCase(
-                input=messages,
-                actual_output=summary
-            )
-            geval_metric.measure(test_case)
-            score = geval_metric.score * 100  # Convert to percentage
-            reason = geval_metric.reason
-            verbose = geval_metric.verbose_logs
-            
+            score, reason, verbose = judge_summary(ctx, convo_hash, messages, summary)
+
             logging.info(f"Evaluation for Conversation ID {convo_id}: Score={score:.2f}%, Reason={reason}")
             logging.info(f"\n\n\nEvaluation for Conversation ID {convo_id}: STEPS USED={verbose}\n\n\n")
-
-            
-            # Check if the score meets the threshold
-            if score >= 80:
-                logging.info(f"Summary for Conversation ID {convo_id} passed evaluation with score {score:.2f}%.")
-                
-                # Append the result to the DataFrame
-                new_record = pd.DataFrame([{
-                    "Conversation_ID": convo_id,
-                    "summary": summary,
-                    "evaluation_score": score,
-                    "evaluation_reason": reason
-                }])
-                responses_df = pd.concat([responses_df, new_record], ignore_index=True)
-                
-                # Save the updated DataFrame to the CSV file
-                responses_df.to_csv(output_csv_path, index=False, encoding='utf-8')
-                logging.info(f"Saved Conversation ID {convo_id} to {output_csv_path}.")
-                break
-            else:
-                logging.warning(f"Summary for Conversation ID {convo_id} failed evaluation with score {score:.2f}%. Retrying with additional context...")
-                
-                # Add feedback to the prompt for refinement
-                prompt += (
-                    "\n\nThe previous summary was evaluated and scored below 90%. "
-                    "Please refine the summary to better capture the key points of the conversation."
-                )
-                attempt += 1
-        
         except Exception as e:
             error_message = f"Error processing Conversation ID {convo_id}: {e}"
             logging.error(error_message)
-            
-            # Append the error to the DataFrame
-            new_record = pd.DataFrame([{
+            if best is None and previous is not None and previous.get("summary"):
+                # keep the stored summary: it is still the base for the next incremental update
+                logging.warning(f"Keeping the previous summary of Conversation ID {convo_id}; it will be updated on the next run.")
+                ctx.count("failed_updates")
+                return None
+            if best is None:
+                return {
+                    "Conversation_ID": convo_id,
+                    "summary": "",
+                    "evaluation_score": 0,
+                    "evaluation_reason": error_message,
+                    "attempts": attempt,
+                    "passed": False,
+                    "chunks": chunks,
+                    "mode": mode
+                }
+            break
+
+        if best is None or score > best["evaluation_score"]:
+            best = {
                 "Conversation_ID": convo_id,
-                "summary": "",
-                "evaluation_score": 0,
-                "evaluation_reason": error_message
-            }])
-            responses_df = pd.concat([responses_df, new_record], ignore_index=True)
-            
-            # Save the updated DataFrame to the CSV file
-            responses_df.to_csv(output_csv_path, index=False, encoding='utf-8')
-            logging.info(f"Saved error for Conversation ID {convo_id} to {output_csv_path}.")
+                "summary": summary,
+                "evaluation_score": score,
+                "evaluation_reason": reason,
+                "best_attempt": attempt
+            }
+
+        # Check if the score meets the threshold
+        if score >= pass_score:
+            logging.info(f"Summary for Conversation ID {convo_id} passed evaluation with score {score:.2f}%.")
+            break
+        if attempt >= ctx.max_attempts or not ctx.take_retry():
+            logging.warning(f"Summary for Conversation ID {convo_id} failed evaluation after {attempt} attempt(s); "
+                            f"keeping the best score {best['evaluation_score']:.2f}% (attempt {best['best_attempt']}).")
             break
 
-# Log the end of the program
-logging.info("Program completed.")
\ No newline at end of file
+        logging.warning(f"Summary for Conversation ID {convo_id} failed evaluation with score {score:.2f}%. Retrying with judge feedback...")
+        prompt = base_prompt + refinement_note(best["summary"], best["evaluation_score"], best["evaluation_reason"])
+        attempt += 1
+
+    return dict(best, attempts=attempt, passed=best["evaluation_score"] >= pass_score, chunks=chunks, mode=mode,
+                **fingerprint)
+
+# --------------------------------------------
+# 7. Persist Results: append-only JSONL log with an in-memory index, exported to CSV
+# --------------------------------------------
+result_columns = ["Conversation_ID", "summary", "evaluation_score", "evaluation_reason", "attempts", "best_attempt", "passed",
+                  "chunks", "mode", "message_count", "last_message", "content_hash"]
+
+def json_default(value):
+    # numpy / pandas scalars from the DataFrame (e.g. an int64 Conversation_ID)
+    return value.item() if hasattr(value, "item") else str(value)
+
+class ResultsLog:
+    """
+    One JSON line per finished conversation, flushed and fsynced as it is written, so a
+    crash loses at most the line being written. Loading keeps the latest record per
+    Conversation_ID and skips a truncated last line. Single writer (the main thread).
+    """
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self.records = {}
+        self._load()
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() > 0 and not self._ends_with_newline():
+            self._file.write("\n")  # never glue a new record onto a line cut off by a crash
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Ignoring unreadable line {line_no} in {self.path} (interrupted write).")
+                    continue
+                if not isinstance(record, dict) or "Conversation_ID" not in record:
+                    logging.warning(f"Ignoring line {line_no} in {self.path}: no Conversation_ID.")
+                    continue
+                self.records[str(record["Conversation_ID"])] = record
+        logging.info(f"Loaded {len(self.records)} results from {self.path}.")
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def __contains__(self, convo_id):
+        return str(convo_id) in self.records
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=json_default)
+        self._file.write(line + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.records[str(record["Conversation_ID"])] = json.loads(line)
+
+    # Results from a run made before the log existed, so they are not summarised again
+    def import_csv(self, path):
+        if not os.path.exists(path):
+            return
+        for record in pd.read_csv(path).fillna({"summary": "", "evaluation_reason": ""}).to_dict("records"):
+            if record["Conversation_ID"] not in self:
+                self.append(record)
+        logging.info(f"Imported {len(self.records)} earlier results from {path}.")
+
+    def export_csv(self, path):
+        df = pd.DataFrame(list(self.records.values()))
+        extra = [column for column in df.columns if column not in result_columns]
+        df.reindex(columns=result_columns + extra).to_csv(path, index=False, encoding='utf-8')
+        logging.info(f"Exported {len(df)} results to {path}.")
+
+    def close(self):
+        self._file.close()
+
+# --------------------------------------------
+# 8. Process Conversations Concurrently; results are saved by the main thread as each one finishes
+# --------------------------------------------
+# Per-run metrics: final score against the number of attempts it took, plus call and cache counters
+def report_run(records, ctx):
+    rows = []
+    for attempts in sorted({record["attempts"] for record in records}):
+        scores = [record["evaluation_score"] for record in records if record["attempts"] == attempts]
+        passed = sum(1 for record in records if record["attempts"] == attempts and record["passed"])
+        rows.append([attempts, len(scores), passed, sum(scores) / len(scores), min(scores)])
+    table = tabulate(rows, headers=["attempts", "conversations", "passed", "mean score", "min score"], floatfmt=".1f")
+    counters = dict(ctx.counters, judge_cache_hits=ctx.judge_cache.hits, retry_budget=ctx.retry_budget,
+                    chunked_conversations=sum(1 for record in records if record.get("chunks")),
+                    incremental_updates=sum(1 for record in records if record.get("mode") == "incremental"),
+                    chunk_cache_hits=ctx.chunk_cache.hits)
+    logging.info(f"Run metrics:\n{table}\n{counters}")
+    print(table)
+    print(counters)
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise conversations with Ollama and score them with G-Eval")
+    parser.add_argument("--input", default=input_csv_path)
+    parser.add_argument("--output", default=output_csv_path, help="CSV exported from the results log at the end of the run")
+    parser.add_argument("--results", default=results_log_path, help="append-only JSONL results log (resumed if it exists)")
+    parser.add_argument("--workers", type=int, default=generation_workers, help="concurrent Ollama generation calls")
+    parser.add_argument("--judge-workers", type=int, default=judge_workers, help="concurrent G-Eval judge calls")
+    parser.add_argument("--max-attempts", type=int, default=max_attempts, help="generations per conversation")
+    parser.add_argument("--retry-budget", type=int, default=run_retry_budget, help="retries shared by the whole run")
+    parser.add_argument("--judge-cache", default=judge_cache_path)
+    parser.add_argument("--num-ctx", type=int, default=num_ctx, help="Ollama context size; longer conversations are map-reduced")
+    parser.add_argument("--chunk-cache", default=chunk_cache_path)
+    args = parser.parse_args()
+
+    # Log the start of the program
+    logging.info("Program started.")
+
+    df = load_conversations(args.input)
+    results = ResultsLog(args.results)
+    if not results.records:
+        results.import_csv(args.output)
+
+    # A conversation is (re)summarised when it is new, its stored result has no summary (an earlier error), or its
+    # fingerprint changed. A result from before fingerprints existed cannot be checked, so it is summarised again in full.
+    pending = []
+    for convo_id, group in df.groupby("Conversation_ID"):
+        group = group.sort_values('Date/Time', kind='stable')
+        previous = results.records.get(str(convo_id))
+        if previous is not None and previous.get("summary"):
+            if "content_hash" not in previous:
+                logging.info(f"Conversation ID {convo_id} has no fingerprint; summarising it again.")
+            elif fingerprint_matches(previous, conversation_fingerprint(group)):
+                logging.info(f"Skipping already processed Conversation ID {convo_id}.")
+                continue
+            else:
+                logging.info(f"Conversation ID {convo_id} changed since it was summarised "
+                             f"({previous.get('message_count')} -> {len(group)} messages).")
+        pending.append((convo_id, group, previous))
+    logging.info(f"{len(pending)} conversations to process with {args.workers} generation and {args.judge_workers} judge workers.")
+
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.workers))
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=args.workers))
+    # chunk summaries get their own pool: conversation workers wait on them, so they must not share a pool
+    chunk_executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="chunk")
+    ctx = RunContext(session, threading.BoundedSemaphore(args.workers), threading.BoundedSemaphore(args.judge_workers),
+                     JudgeCache(args.judge_cache), args.max_attempts, args.retry_budget,
+                     args.num_ctx, ChunkCache(args.chunk_cache), chunk_executor)
+
+    # enough threads for both stages to be busy at once; the semaphores enforce each stage's own limit
+    executor = ThreadPoolExecutor(max_workers=args.workers + args.judge_workers, thread_name_prefix="convo")
+    run_records = []
+    try:
+        futures = [executor.submit(summarise_conversation, convo_id, group, ctx, previous)
+                   for convo_id, group, previous in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            if record is None:
+                continue
+            results.append(record)
+            run_records.append(record)
+            logging.info(f"Saved Conversation ID {record['Conversation_ID']} ({done}/{len(pending)}).")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        chunk_executor.shutdown(wait=True)
+        results.close()
+        results.export_csv(args.output)
+        ctx.judge_cache.close()
+        ctx.chunk_cache.close()
+
+    if run_records or ctx.counters["failed_updates"]:
+        report_run(run_records, ctx)
+
+    # Log the end of the program
+    logging.info("Program completed.")
+
+
+if __name__ == "__main__":
+    main()